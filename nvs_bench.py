@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2024 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+import argparse
+import io
+import random
+import struct
+import time
+from typing import Callable
+from typing import List
+
+import nvs_check
+import nvs_parser
+from nvs_parser import nvs_const
+from nvs_parser import NVS_Entry
+from nvs_parser import NVS_Page
+
+
+def synthetic_image(size: int, seed: int = 0) -> bytes:
+    """Generates a partition of `size` bytes filled with namespaces, numbers and strings
+    """
+    import nvs_partition_gen
+
+    rnd = random.Random(seed)
+    result = io.BytesIO()
+    nvs = nvs_partition_gen.nvs_open(result, size, nvs_partition_gen.Page.VERSION2)
+    try:
+        # Namespace index is a u8 (0 and 0xFF are reserved), large partitions get more keys per namespace
+        namespaces = max(min(size // 0x2000, 254), 1)
+        keys = max(size // 0x2000 * 100 // namespaces, 100)
+        for n in range(namespaces):
+            nvs_partition_gen.write_entry(nvs, f'ns{n}', 'namespace', '', '')
+            for k in range(keys):
+                encoding = rnd.choice(['u8', 'i16', 'u32', 'i64', 'string'])
+                if encoding == 'string':
+                    value = f'value_{k}_' * rnd.randint(0, 8)
+                elif encoding == 'i16':
+                    value = str(rnd.randint(-0x8000, 0x7FFF))
+                else:
+                    value = str(rnd.randint(0, 0xFF))
+                nvs_partition_gen.write_entry(nvs, f'key_{n}_{k}', 'data', encoding, value)
+    except nvs_partition_gen.InsufficientSizeError:
+        pass  # Partition is full
+    nvs_partition_gen.nvs_close(nvs)
+    return result.getvalue()
+
+
+def colliding_entries(count: int) -> List[NVS_Entry]:
+    """Returns `count` written entries sharing the same key (numbers, blob indexes and blob chunks
+    spread over a few namespaces), the worst case for duplicate detection
+    """
+    entry = struct.Struct('<BBBBI16s8s')
+    item_types = [0x01, 0x14, 0x48, 0x42]
+    entries = []
+    for i in range(count):
+        item_type = item_types[i % len(item_types)]
+        chunk_index = i % 16 if item_type == 0x42 else 0xFF
+        raw = entry.pack(1 + i % 8, item_type, 1, chunk_index, 0, b'collision', bytes(8))
+        entries.append(NVS_Entry(i % 126, raw, 'Written'))
+    return entries
+
+
+def measure(func: Callable[[], int], repeat: int) -> float:
+    """Returns the best rate of `func` (items per second), `func` returns the number of processed items
+    """
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = func()
+        best = max(best, count / (time.perf_counter() - start))
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measure NVS parser throughput')
+    parser.add_argument('file', nargs='?', help='Partition to parse (a synthetic one is generated by default)')
+    parser.add_argument('--size', type=lambda x: int(x, 0), default=0x100000, help='Size of the synthetic partition')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs, the best one is reported')
+    parser.add_argument(
+        '--collisions', type=int, default=4000, help='Number of entries with the same key for the duplicate check'
+    )
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, 'rb') as f:
+            raw_data = f.read()
+    else:
+        raw_data = synthetic_image(args.size)
+
+    image = memoryview(raw_data)
+    pages: List[memoryview] = [
+        image[i: i + nvs_const.page_size] for i in range(0, len(image), nvs_const.page_size)
+    ]
+    entries_per_page = nvs_const.page_size // nvs_const.entry_size - 2
+    written = [entry for page in nvs_parser.NVS_Partition('bench', raw_data).pages for entry in page.entries
+               if entry.state == 'Written']
+
+    def decode_entries() -> int:
+        for page in pages:
+            for i in range(2, entries_per_page + 2):
+                NVS_Entry(i - 2, page, 'Written', offset=i * nvs_const.entry_size)
+        return len(pages) * entries_per_page
+
+    def decode_values() -> int:
+        for entry in written:
+            entry.data
+        return len(written)
+
+    def decode_bitmaps() -> int:
+        for page in pages:
+            nvs_parser.decode_page_row(page)
+        return len(pages)
+
+    def parse_pages() -> int:
+        for i, page in enumerate(pages):
+            NVS_Page(page, i * nvs_const.page_size)
+        return len(pages) * entries_per_page
+
+    colliding = {'collision': colliding_entries(args.collisions)}
+
+    def find_duplicates() -> int:
+        nvs_check.filter_entry_duplicates(colliding)
+        return args.collisions
+
+    print(f'{len(pages)} pages, {len(written)} written entries')
+    print(f'entry headers:  {measure(decode_entries, args.repeat):12,.0f} entries/s')
+    print(f'entry values:   {measure(decode_values, args.repeat):12,.0f} entries/s')
+    print(f'page bitmaps:   {measure(decode_bitmaps, args.repeat):12,.0f} pages/s')
+    print(f'full pages:     {measure(parse_pages, args.repeat):12,.0f} entries/s')
+    print(f'duplicates:     {measure(find_duplicates, args.repeat):12,.0f} entries/s ({args.collisions} colliding keys)')
+
+
+if __name__ == '__main__':
+    main()
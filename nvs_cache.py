@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2024 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+import hashlib
+import marshal
+import os
+import tempfile
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import nvs_parser
+from nvs_parser import NVS_Page_Row
+from nvs_parser import NVS_Partition
+
+
+# Bump when the layout of the cached payload changes
+CACHE_FORMAT = 1
+CACHE_SUFFIX = '.nvscache'
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024  # 64 MiB
+
+
+def parser_fingerprint() -> bytes:
+    """Returns a digest identifying the parser, cache entries written by a different parser
+    (changed source of `nvs_parser`, cache format or marshal version) are never used
+    """
+    digest = hashlib.sha256(f'{CACHE_FORMAT}:{marshal.version}:'.encode())
+    with open(nvs_parser.__file__, 'rb') as f:
+        digest.update(f.read())
+    return digest.digest()
+
+
+def _umask() -> int:
+    umask = os.umask(0)  # The only way to read it
+    os.umask(umask)
+    return umask
+
+
+class NVS_Cache:
+    """On-disk cache of decoded partitions keyed by a hash of the image and of the parser
+
+    Every entry holds the fully decoded page rows (see `NVS_Page.row()`) and the namespace map
+    of one image, serialized with `marshal`. Values are not stored, they are windows into the image
+    and are reassembled from it on demand. Entries are evicted least recently used first
+    (by file modification time, which is updated on every hit) once the cache grows over `max_size` bytes.
+
+    A hit skips decoding of page and entry headers, entry objects are still created from the rows,
+    which makes opening an image about twice as fast. Rows hold a few fields of every entry,
+    an entry takes about half the size of the image, up to its full size for images full of small items.
+    """
+    def __init__(self, directory: str, max_size: int = DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self._fingerprint: Optional[bytes] = None
+
+    def key(self, raw_data: Any) -> str:
+        if self._fingerprint is None:
+            self._fingerprint = parser_fingerprint()
+        digest = hashlib.sha256(self._fingerprint)
+        digest.update(raw_data)
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def load(
+        self, path: str, backend: str = 'python', offset: int = 0, length: Optional[int] = None
+    ) -> NVS_Partition:
+        """Opens partition at `path` (see `NVS_Partition.from_file()`), decoded form of the image is taken
+        from the cache if present, otherwise the whole partition is decoded and stored in the cache
+        """
+        nvs = NVS_Partition.from_file(path, offset, length)
+        key = self.key(nvs.raw_data)
+        cached = self.get(key, len(nvs.pages))
+        if cached is not None:
+            rows, namespaces = cached
+            # Rows already hold everything a backend would decode
+            cached_nvs = NVS_Partition(nvs.name, nvs.raw_data, rows=rows, namespaces=namespaces)
+            cached_nvs.source = nvs.source
+            return cached_nvs
+        if backend != 'python':
+            source = nvs.source
+            nvs = NVS_Partition(nvs.name, nvs.raw_data, backend)
+            nvs.source = source
+        self.put(key, nvs)
+        return nvs
+
+    def get(self, key: str, page_count: int) -> Optional[Tuple[List[Optional[NVS_Page_Row]], Dict[int, str]]]:
+        """Returns cached (rows, namespaces) of image with the given key, None on a miss or a damaged entry
+        """
+        try:
+            with open(self.path(key), 'rb') as f:
+                payload = marshal.loads(f.read())  # Much faster than unmarshalling from the file
+            cache_format, rows, namespaces = payload
+            if cache_format != CACHE_FORMAT or len(rows) != page_count:
+                return None
+            rows = [None if row is None else NVS_Page_Row(*row) for row in rows]
+            os.utime(self.path(key))  # Mark as recently used
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        return rows, namespaces
+
+    def put(self, key: str, nvs: NVS_Partition) -> None:
+        """Stores decoded form of the partition (decodes all its pages), the cache is then trimmed to `max_size`
+        """
+        payload = marshal.dumps((CACHE_FORMAT, [None if row is None else tuple(row) for row in nvs.rows()], nvs.namespaces()))
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Write to a temporary file first, so readers never see a partially written entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(payload)
+                # Temporary files are readable by their owner only, a shared cache needs the usual permissions
+                os.chmod(tmp_path, 0o666 & ~_umask())
+                os.replace(tmp_path, self.path(key))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError:
+            return  # Caching is best effort, the partition is already decoded
+        self.evict()
+
+    def evict(self) -> None:
+        """Removes least recently used entries until the cache fits into `max_size`
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(CACHE_SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self) -> None:
+        for name in os.listdir(self.directory):
+            if name.endswith(CACHE_SUFFIX):
+                os.unlink(os.path.join(self.directory, name))
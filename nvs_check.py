@@ -1,54 +1,91 @@
 #!/usr/bin/env python3
 # SPDX-FileCopyrightText: 2023-2024 Espressif Systems (Shanghai) CO LTD
 # SPDX-License-Identifier: Apache-2.0
+import io
+import os
+from concurrent.futures import as_completed
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+from typing import Callable
 from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
+from typing import NamedTuple
 from typing import Optional
-from typing import Set
+from typing import Tuple
 
+import nvs_cache
+import nvs_parser
 from nvs_logger import NVS_Logger
 from nvs_parser import nvs_const
+from nvs_parser import NVS_CRC_Mismatch
 from nvs_parser import NVS_Entry
+from nvs_parser import NVS_Index
 from nvs_parser import NVS_Page
 from nvs_parser import NVS_Partition
 
 
-EMPTY_ENTRY = NVS_Entry(-1, bytearray(32), 'Erased')
+# Stages of the integrity check, in the order they run
+CHECKS = (
+    'size',  # Partition size and presence of an empty page
+    'page',  # Empty page content, entry states, types and spans
+    'crc',  # Page header, entry header and data CRC32
+    'dup',  # Duplicate entries
+    'blob',  # Blob chunks and sizes
+    'ns',  # Namespace definitions and usage
+)
 
-used_namespaces: Dict[int, Optional[str]] = {}
-found_namespaces: Dict[int, str] = {}
-blobs: Dict = {}
-blob_chunks: List[NVS_Entry] = []
 
+# Blob chunk index ranges by chunk start of the blob index (two versions of a blob are kept
+# while it is being rewritten), chunk index 0xFF is reserved
+BLOB_VERSION_END = {0x00: 0x80, 0x80: 0xFF}
 
-def check_partition_size(nvs_partition: NVS_Partition, nvs_log: NVS_Logger) -> bool:
+
+class NVS_Finding(NamedTuple):
+    """Single problem found by the integrity check
+    """
+    code: str  # Kind of the problem, e.g. 'entry_crc', 'duplicate_entry', 'blob_missing_chunk'
+    severity: str  # 'error' or 'warning'
+    message: str
+    partition: Optional[str] = None
+    page: Optional[int] = None  # Page number (position in the partition)
+    entry: Optional[int] = None  # Entry index
+    namespace: Optional[int] = None  # Namespace index
+    key: Optional[str] = None
+    expected: Optional[int] = None  # Computed CRC32
+    actual: Optional[int] = None  # Written CRC32
+
+
+Reporter = Callable[[NVS_Finding], None]
+
+
+def _page_number(nvs_page: Optional[NVS_Page]) -> Optional[int]:
+    return None if nvs_page is None else nvs_page.start_address // nvs_const.page_size
+
+
+def check_partition_size(
+    nvs_partition: NVS_Partition, nvs_log: NVS_Logger, report: Optional[Reporter] = None
+) -> bool:
     """ Checks if the partition is large enough and has enough pages
     """
     if len(nvs_partition.raw_data) / 0x1000 < 3:
-        nvs_log.info(
-            nvs_log.yellow(
-                'NVS Partition size must be at least 0x3000 (4kiB * 3 pages == 12kiB)!'
-            )
-        )
-        return False
-    if len(nvs_partition.raw_data) % 0x1000 != 0:
-        nvs_log.info(
-            nvs_log.yellow(
-                'NVS Partition size must be a multiple of 0x1000 (4kiB)!'
-            )
-        )
-        return False
-    if len(nvs_partition.pages) < 3:
-        nvs_log.info(
-            nvs_log.yellow(
-                'NVS Partition must contain 3 pages (sectors) at least to function properly!'
-            )
-        )
-        return False
-    return True
+        message = 'NVS Partition size must be at least 0x3000 (4kiB * 3 pages == 12kiB)!'
+    elif len(nvs_partition.raw_data) % 0x1000 != 0:
+        message = 'NVS Partition size must be a multiple of 0x1000 (4kiB)!'
+    elif len(nvs_partition.pages) < 3:
+        message = 'NVS Partition must contain 3 pages (sectors) at least to function properly!'
+    else:
+        return True
+    nvs_log.info(nvs_log.yellow(message))
+    if report is not None:
+        report(NVS_Finding('partition_size', 'warning', message, nvs_partition.name))
+    return False
 
 
-def check_empty_page_present(nvs_partition: NVS_Partition, nvs_log: NVS_Logger) -> bool:
+def check_empty_page_present(
+    nvs_partition: NVS_Partition, nvs_log: NVS_Logger, report: Optional[Reporter] = None
+) -> bool:
     if not any(page.header['status'] == 'Empty' for page in nvs_partition.pages):
         nvs_log.info(
             nvs_log.red(
@@ -57,33 +94,50 @@ at least one free page is required for proper function!'''
             )
         )
         nvs_log.info(nvs_log.red('NVS partition possibly truncated?\n'))
+        if report is not None:
+            report(NVS_Finding(
+                'no_empty_page', 'error', 'No free (empty) page found in the NVS partition', nvs_partition.name
+            ))
         return False
     return True
 
 
-def check_empty_page_content(nvs_page: NVS_Page, nvs_log: NVS_Logger) -> bool:
+def check_empty_page_content(
+    nvs_page: NVS_Page, nvs_log: NVS_Logger, report: Optional[Reporter] = None, partition: Optional[str] = None
+) -> bool:
     result = True
     nvs_log.info(nvs_log.cyan(f'Page {nvs_page.header["status"]}'))
 
     if nvs_page.raw_entry_state_bitmap != bytearray({0xFF}) * nvs_const.entry_size:
         result = False
-        nvs_log.info(
-            nvs_log.red(
-                'The page is reported as Empty but its entry state bitmap is not empty!'
-            )
-        )
+        message = 'The page is reported as Empty but its entry state bitmap is not empty!'
+        nvs_log.info(nvs_log.red(message))
+        if report is not None:
+            report(NVS_Finding('empty_page_bitmap', 'error', message, partition, _page_number(nvs_page)))
 
     if any([not e.is_empty for e in nvs_page.entries]):
         result = False
-        nvs_log.info(
-            nvs_log.red('The page is reported as Empty but there are data written!')
-        )
+        message = 'The page is reported as Empty but there are data written!'
+        nvs_log.info(nvs_log.red(message))
+        if report is not None:
+            report(NVS_Finding('empty_page_data', 'error', message, partition, _page_number(nvs_page)))
 
     return result
 
 
-def check_page_crc(nvs_page: NVS_Page, nvs_log: NVS_Logger) -> bool:
-    if nvs_page.header['crc']['original'] == nvs_page.header['crc']['computed']:
+def check_page_crc(
+    nvs_page: NVS_Page,
+    nvs_log: NVS_Logger,
+    crc_mismatches: Optional[List[NVS_CRC_Mismatch]] = None,
+    report: Optional[Reporter] = None,
+    partition: Optional[str] = None,
+) -> bool:
+    """Checks the page header CRC32, `crc_mismatches` are results of `nvs_page.verify_crcs()` if already known
+    """
+    if crc_mismatches is None:
+        crc_mismatches = nvs_page.verify_crcs()
+    mismatch = next((m for m in crc_mismatches if m.kind == 'page'), None)
+    if mismatch is None:
         nvs_log.info(
             nvs_log.cyan(f'Page no. {nvs_page.header["page_index"]}'), '\tCRC32: OK'
         )
@@ -92,10 +146,15 @@ def check_page_crc(nvs_page: NVS_Page, nvs_log: NVS_Logger) -> bool:
         nvs_log.info(
             nvs_log.cyan(f'Page no. {nvs_page.header["page_index"]}'),
             f'Original CRC32:',
-            nvs_log.red(f'{nvs_page.header["crc"]["original"]:x}'),
+            nvs_log.red(f'{mismatch.original:x}'),
             f'Generated CRC32:',
-            nvs_log.green(f'{nvs_page.header["crc"]["computed"]:x}'),
+            nvs_log.green(f'{mismatch.computed:x}'),
         )
+        if report is not None:
+            report(NVS_Finding(
+                'page_crc', 'error', 'Page header has wrong CRC32!', partition, mismatch.page,
+                expected=mismatch.computed, actual=mismatch.original,
+            ))
         return False
 
 
@@ -112,222 +171,17 @@ def identify_entry_duplicates(entry: NVS_Entry, entry_dict: Dict[str, List[NVS_E
     return entry_dict
 
 
-def check_page_entries(nvs_page: NVS_Page, nvs_log: NVS_Logger) -> Dict[str, List[NVS_Entry]]:
-    """Checks entries in the given page (entry state, children CRC32, entry type, span and gathers blobs and namespaces)
-    """
-    seen_written_entires: Dict[str, List[NVS_Entry]] = {}
-
-    for entry in nvs_page.entries:
-        # entry: NVS_Entry
-        entry.page = nvs_page
-
-        # Entries stored in 'page.entries' are primitive data types, blob indexes or string/blob data
-
-        # Variable length values themselves occupy whole 32 bytes (therefore metadata values are meaningless)
-        # and are stored in as entries inside string/blob data entry 'entry.children' list
-
-        # Duplicate entry check (1) - same key, different index - find duplicates
-        seen_written_entires = identify_entry_duplicates(entry, seen_written_entires)
+def _duplicate_class(entry: NVS_Entry) -> Tuple[int, Optional[str], str, Optional[int]]:
+    """Returns the (namespace, key, type class, chunk index) an entry is a duplicate within
 
-        # Entry state check - doesn't check variable length values (metadata such as state are meaningless as all 32 bytes are pure data)
-        if entry.is_empty:
-            if entry.state == 'Written':
-                nvs_log.info(
-                    nvs_log.red(
-                        f' Entry #{entry.index:03d} is reported as Written but it is empty!'
-                    )
-                )
-                continue
-            elif entry.state == 'Erased':
-                nvs_log.info(
-                    nvs_log.yellow(
-                        f' Entry #{entry.index:03d} is reported as Erased but it is empty! (Only entries reported as Empty should be empty)'
-                    )
-                )
-
-        if entry.state == 'Written':
-            # Entry CRC32 check
-            if (
-                entry.metadata['crc']['original']
-                != entry.metadata['crc']['computed']
-            ):
-                nvs_log.info(
-                    nvs_log.red(
-                        f' Entry #{entry.index:03d} {entry.key} has wrong CRC32!{"": <5}'
-                    ),
-                    f'Written:',
-                    nvs_log.red(f'{entry.metadata["crc"]["original"]:x}'),
-                    f'Generated:',
-                    nvs_log.green(f'{entry.metadata["crc"]["computed"]:x}'),
-                )
-
-            # Entry children CRC32 check
-            if (
-                entry.metadata['span'] > 1
-                and (entry.metadata['crc']['data_original'] != entry.metadata['crc']['data_computed'])
-            ):
-                nvs_log.info(
-                    nvs_log.red(
-                        f' Entry #{entry.index:03d} {entry.key} data (string, blob) has wrong CRC32!'
-                    ),
-                    f'Written:',
-                    nvs_log.red(f'{entry.metadata["crc"]["data_original"]:x}'),
-                    f'Generated:',
-                    nvs_log.green(f'{entry.metadata["crc"]["data_computed"]:x}'),
-                )
-
-            # Entry type check
-            if entry.metadata['type'] not in [
-                nvs_const.item_type[key] for key in nvs_const.item_type
-            ]:
-                nvs_log.info(
-                    nvs_log.yellow(
-                        f' Type of entry #{entry.index:03d} {entry.key} is unrecognized!'
-                    ),
-                    f'Type: {entry.metadata["type"]}',
-                )
-
-            # Span check
-            if (
-                entry.index + entry.metadata['span'] - 1
-                >= int(nvs_const.page_size / nvs_const.entry_size) - 2
-            ):
-                nvs_log.info(
-                    nvs_log.red(
-                        f' Variable length entry #{entry.index:03d} {entry.key} is out of bounds!'
-                    )
-                )
-            # Spanned entry state checks
-            elif entry.metadata['span'] > 1:
-                parent_state = entry.state
-                for kid in entry.children:
-                    if parent_state != kid.state:
-                        nvs_log.info(
-                            nvs_log.yellow(' Inconsistent data state!'),
-                            f'Entry #{entry.index:03d} {entry.key} state: {parent_state},',
-                            f'Data entry #{kid.index:03d} {entry.key} state: {kid.state}',
-                        )
-
-            # Gather blobs & namespaces
-            if entry.metadata['type'] == 'blob_index':
-                blobs[f'{entry.metadata["namespace"]:03d}{entry.key}'] = [entry] + [
-                    EMPTY_ENTRY
-                ] * entry.data['chunk_count']
-            elif entry.metadata['type'] == 'blob_data':
-                blob_chunks.append(entry)
-
-            if entry.metadata['namespace'] == 0:
-                found_namespaces[entry.data['value']] = entry.key
-            else:
-                used_namespaces[entry.metadata['namespace']] = None
-
-    return seen_written_entires
-
-
-def filter_namespaces_fake_duplicates(duplicate_entries_dict: Dict[str, List[NVS_Entry]]) -> Dict[str, List[NVS_Entry]]:
-    """Takes a dictionary of entries (as written) and returns a new dictionary with "fake" duplicates,
-    where entries which have the same key but under different namespaces are filtered out
-
-    Use `filter_entry_duplicates()` to properly filter out all duplicates
+    Blob indexes and blob data of the same key do not collide with each other,
+    blob data only collide with blob data of the same chunk index
     """
-    new_duplicate_entries_dict: Dict[str, List[NVS_Entry]] = {}
-    for key, duplicate_entries in duplicate_entries_dict.items():
-        seen_entries: List[NVS_Entry] = []
-        entry_same_namespace_collisions_list: Set[NVS_Entry] = set()
-
-        # Search through the "duplicates" and see if there are real duplicates
-        # E.g. the key can be the same if the namespace is different
-        for entry in duplicate_entries:
-            if entry.metadata['type'] in nvs_const.item_type.values():
-
-                entry_same_namespace_collisions = set()
-                for other_entry in seen_entries:
-                    if entry.metadata['namespace'] == other_entry.metadata['namespace']:
-                        entry_same_namespace_collisions.add(entry)
-                        entry_same_namespace_collisions.add(other_entry)
-
-                if len(entry_same_namespace_collisions) != 0:
-                    entry_same_namespace_collisions_list.update(entry_same_namespace_collisions)
-                seen_entries.append(entry)
-
-        # Catch real duplicates
-        new_duplicate_entries: List[NVS_Entry] = []
-        if len(seen_entries) > 1:
-            for entry in seen_entries:
-                if entry in entry_same_namespace_collisions_list:
-                    new_duplicate_entries.append(entry)
-
-        if len(new_duplicate_entries) > 0:
-            new_duplicate_entries_dict[key] = new_duplicate_entries
-
-    return new_duplicate_entries_dict
-
-
-def filter_blob_related_duplicates(duplicate_entries_dict: Dict[str, List[NVS_Entry]]) -> Dict[str, List[NVS_Entry]]:
-    """Takes a dictionary of entries (as written) and returns a new dictionary with "fake" duplicates,
-    where entries related to blob index and blob data under the same namespace are filtered out
-
-    Use `filter_entry_duplicates()` to properly filter out all duplicates
-    """
-    new_duplicate_entries_dict: Dict[str, List[NVS_Entry]] = {}
-    for key, duplicate_entries in duplicate_entries_dict.items():
-        seen_blob_index: List[NVS_Entry] = []
-        seen_blob_data: List[NVS_Entry] = []
-        seen_another_type_data: List[NVS_Entry] = []
-        blob_index_chunk_index_collisions_list: Set[NVS_Entry] = set()
-        blob_data_chunk_index_collisions_list: Set[NVS_Entry] = set()
-
-        # Search through the "duplicates" and see if there are real duplicates
-        # E.g. the key can be the same for blob_index and blob_data
-        # (and even for more blob_data entries if they have a different chunk_index)
-        for entry in duplicate_entries:
-            if entry.metadata['type'] == 'blob_index':
-
-                blob_index_chunk_index_collisions = set()
-                for other_entry in seen_blob_index:
-                    if entry.metadata['namespace'] == other_entry.metadata['namespace']:
-                        blob_index_chunk_index_collisions.add(entry)
-                        blob_index_chunk_index_collisions.add(other_entry)
-
-                if len(blob_index_chunk_index_collisions) != 0:
-                    blob_index_chunk_index_collisions_list.update(blob_index_chunk_index_collisions)
-                seen_blob_index.append(entry)
-
-            elif entry.metadata['type'] == 'blob_data':
-
-                blob_data_chunk_index_collisions = set()
-                for other_entry in seen_blob_data:
-                    if (entry.metadata['namespace'] == other_entry.metadata['namespace']
-                            and entry.metadata['chunk_index'] == other_entry.metadata['chunk_index']):
-                        blob_data_chunk_index_collisions.add(entry)
-                        blob_data_chunk_index_collisions.add(other_entry)
-
-                if len(blob_data_chunk_index_collisions) != 0:
-                    blob_data_chunk_index_collisions_list.update(blob_data_chunk_index_collisions)
-                seen_blob_data.append(entry)
-
-            else:
-                seen_another_type_data.append(entry)
-
-        # Catch real duplicates
-        new_duplicate_entries: List[NVS_Entry] = []
-        if len(seen_blob_index) > 1:
-            for entry in seen_blob_index:
-                if entry in blob_index_chunk_index_collisions_list:
-                    new_duplicate_entries.append(entry)
-
-        if len(seen_blob_data) > 1:
-            for entry in seen_blob_data:
-                if entry in blob_data_chunk_index_collisions_list:
-                        new_duplicate_entries.append(entry)
-
-        for entry in seen_another_type_data:  # If there are any duplicates of other types
-            new_duplicate_entries.append(entry)
-
-        if len(new_duplicate_entries) > 0:
-            new_duplicate_entries_dict[key] = new_duplicate_entries
-
-    return new_duplicate_entries_dict
+    if entry.type_name == 'blob_index':
+        return (entry.namespace, entry.key, 'blob_index', None)
+    if entry.type_name == 'blob_data':
+        return (entry.namespace, entry.key, 'blob_data', entry.chunk_index)
+    return (entry.namespace, entry.key, 'other', None)
 
 
 def filter_entry_duplicates(entries: Dict[str, List[NVS_Entry]]) -> Dict[str, List[NVS_Entry]]:
@@ -336,18 +190,59 @@ def filter_entry_duplicates(entries: Dict[str, List[NVS_Entry]]) -> Dict[str, Li
     (i.e. duplicate keys under different namespaces and blob index and blob data having the same key under the same namespace are allowed
     and should be filtered out)
 
-    Part 2 of duplicate entry check mechanism
-    """
-    # Only keep seen written entries which have been observerd multiple times (duplicates)
-    duplicate_entries_list = {key: v for key, v in entries.items() if len(v) > 1}
-    # Filter out "fake" duplicates 1 (duplicate keys under different namespaces are allowed)
-    duplicate_entries_list_1 = filter_namespaces_fake_duplicates(duplicate_entries_list)
-    # Filter out "fake" duplicates 2 (blob index and blob data are allowed to have the same key even in the same namespace)
-    duplicate_entries_list_2 = filter_blob_related_duplicates(duplicate_entries_list_1)
-    return duplicate_entries_list_2
-
+    Entries of unknown types are ignored. Blob indexes are duplicates of other blob indexes and blob data of other blob data
+    with the same chunk index (in the same namespace), any other entry is a duplicate of any entry of a known type
+    under the same namespace and key. Duplicates of every key are listed as blob indexes, blob data, other entries.
 
-def print_entry_duplicates(duplicate_entries_list: Dict[str, List[NVS_Entry]], nvs_log: NVS_Logger) -> None:
+    Part 2 of duplicate entry check mechanism, entries are counted in a single pass so it runs in linear time
+    """
+    known_types = set(nvs_const.item_type.values())
+
+    # Count entries by (namespace, key, type class, chunk index) and by (namespace, key)
+    class_counts: Dict[Tuple[int, Optional[str], str, Optional[int]], int] = {}
+    key_counts: Dict[Tuple[int, Optional[str]], int] = {}
+    for seen_entries in entries.values():
+        if len(seen_entries) < 2:  # Only keys observed multiple times can have duplicates
+            continue
+        for entry in seen_entries:
+            if entry.type_name not in known_types:
+                continue
+            duplicate_class = _duplicate_class(entry)
+            class_counts[duplicate_class] = class_counts.get(duplicate_class, 0) + 1
+            key_counts[(entry.namespace, entry.key)] = key_counts.get((entry.namespace, entry.key), 0) + 1
+
+    duplicate_entries_dict: Dict[str, List[NVS_Entry]] = {}
+    for key, seen_entries in entries.items():
+        if len(seen_entries) < 2:
+            continue
+        blob_index_duplicates: List[NVS_Entry] = []
+        blob_data_duplicates: List[NVS_Entry] = []
+        other_duplicates: List[NVS_Entry] = []
+        for entry in seen_entries:
+            if entry.type_name not in known_types:
+                continue
+            if entry.type_name == 'blob_index':
+                if class_counts[_duplicate_class(entry)] > 1:
+                    blob_index_duplicates.append(entry)
+            elif entry.type_name == 'blob_data':
+                if class_counts[_duplicate_class(entry)] > 1:
+                    blob_data_duplicates.append(entry)
+            elif key_counts[(entry.namespace, entry.key)] > 1:
+                other_duplicates.append(entry)
+
+        duplicate_entries = blob_index_duplicates + blob_data_duplicates + other_duplicates
+        if len(duplicate_entries) > 0:
+            duplicate_entries_dict[key] = duplicate_entries
+
+    return duplicate_entries_dict
+
+
+def print_entry_duplicates(
+    duplicate_entries_list: Dict[str, List[NVS_Entry]],
+    nvs_log: NVS_Logger,
+    report: Optional[Reporter] = None,
+    partition: Optional[str] = None,
+) -> None:
     if len(duplicate_entries_list) > 0:
         nvs_log.info(nvs_log.red('Found duplicate entries:'))
         nvs_log.info(nvs_log.red('Entry\tKey\t\t\tType\t\tNamespace idx\tPage\tPage status'))
@@ -356,10 +251,10 @@ def print_entry_duplicates(duplicate_entries_list: Dict[str, List[NVS_Entry]], n
         # duplicate_entries: List[NVS_Entry]
         for entry in duplicate_entries:
             # entry: NVS_Entry
-            if entry.metadata['namespace'] == 0:
+            if entry.namespace == 0:
                 entry_type = f'namespace ({entry.data["value"]})'
             else:
-                entry_type = entry.metadata['type']
+                entry_type = entry.type_name
 
             if entry.page is not None:
                 page_num = entry.page.header['page_index']
@@ -373,150 +268,619 @@ def print_entry_duplicates(duplicate_entries_list: Dict[str, List[NVS_Entry]], n
 
             namespace_tab_cnt = len(entry_type) // 8
             namepace_tab = '\t' * (2 - namespace_tab_cnt)
-            namespace_str = f'{entry.metadata["namespace"]}'
+            namespace_str = f'{entry.namespace}'
 
             nvs_log.info(
                 nvs_log.red(
                     f'#{entry.index:03d}\t{entry.key}{entry_key_tab}{entry_type}{namepace_tab}{namespace_str}\t\t{page_num}\t{page_status}'
                 )
             )
+            if report is not None:
+                report(NVS_Finding(
+                    'duplicate_entry', 'error', f'Duplicate entry {entry.key} ({entry_type})', partition,
+                    _page_number(entry.page), entry.index, entry.namespace, entry.key,
+                ))
 
 
-def assemble_blobs(nvs_log: NVS_Logger) -> None:
-    """Assembles blob data from blob chunks
-    """
-    for chunk in blob_chunks:
-        # chunk: NVS_Entry
-        parent = blobs.get(
-            f'{chunk.metadata["namespace"]:03d}{chunk.key}', [EMPTY_ENTRY]
-        )[0]
-        # Blob chunk without blob index check
-        if parent is EMPTY_ENTRY:
-            nvs_log.info(
-                nvs_log.red(f'Blob {chunk.key} chunk has no blob index!'),
-                f'Namespace index: {chunk.metadata["namespace"]:03d}',
-                f'[{found_namespaces.get(chunk.metadata["namespace"], "undefined")}],',
-                f'Chunk Index: {chunk.metadata["chunk_index"]:03d}',
-            )
-        else:
-            blob_key = f'{chunk.metadata["namespace"]:03d}{chunk.key}'
-            chunk_index = chunk.metadata['chunk_index'] - parent.data['chunk_start']
-            blobs[blob_key][chunk_index + 1] = chunk
+class _Null_Stream(io.StringIO):
+    def write(self, s: str) -> int:
+        return len(s)
 
 
-def check_blob_data(nvs_log: NVS_Logger) -> None:
-    """Checks blob data for missing chunks or data
+class _Stop_Check(Exception):
+    """Raised to end the check at the first error in fail-fast mode
     """
-    for blob_key in blobs:
-        blob_index = blobs[blob_key][0]
-        blob_chunks = blobs[blob_key][1:]
-        blob_size = blob_index.data['size']
-
-        for i, chunk in enumerate(blob_chunks):
-            # chunk: NVS_Entry
-            # Blob missing chunk check
-            if chunk is EMPTY_ENTRY:
-                nvs_log.info(
-                    nvs_log.red(f'Blob {blob_index.key} is missing a chunk!'),
-                    f'Namespace index: {blob_index.metadata["namespace"]:03d}',
-                    f'[{found_namespaces.get(blob_index.metadata["namespace"], "undefined")}],',
-                    f'Chunk Index: {i:03d}',
-                )
-            else:
-                blob_size -= len(chunk.children) * nvs_const.entry_size
-
-        # Blob missing data check
-        if blob_size > 0:
-            nvs_log.info(
-                nvs_log.red(f'Blob {blob_index.key} is missing {blob_size} B of data!'),
-                f'Namespace index: {blob_index.metadata["namespace"]:03d}',
-            )
 
 
-def check_blobs(nvs_log: NVS_Logger) -> None:
-    # Assemble blobs
-    assemble_blobs(nvs_log)
-    # Blob data check
-    check_blob_data(nvs_log)
+class IntegrityChecker:
+    """Multi-stage integrity check of a NVS partition
 
+    Every instance keeps its own state (namespaces found on the way) and writes to its own logger,
+    so checks of different partitions can run in parallel threads. An instance can be reused,
+    its state is cleared at the start of every `check()`.
 
-def check_namespaces(nvs_log: NVS_Logger) -> None:
-    """Checks namespaces (entries using undefined namespace indexes, unused namespaces)
+    Besides the text report every problem is recorded as a `NVS_Finding`. Without a logger
+    only the findings are produced. `checks` selects the stages to run (see `CHECKS`),
+    with `fail_fast` the check ends at the first error.
     """
-    # Undefined namespace index check
-    for used_ns in used_namespaces:
-        key = found_namespaces.pop(used_ns, None)
-        if key is None:
-            nvs_log.info(
-                nvs_log.red('Undefined namespace index!'),
-                f'Namespace index: {used_ns:03d}',
-                f'[undefined]',
-            )
+    def __init__(
+        self, nvs_log: Optional[NVS_Logger] = None, checks: Iterable[str] = CHECKS, fail_fast: bool = False
+    ):
+        self.nvs_log = nvs_log if nvs_log is not None else NVS_Logger(color='never', file=_Null_Stream())
+        self.checks = set(checks)
+        unknown = self.checks.difference(CHECKS)
+        if unknown:
+            raise ValueError(f'Unknown checks: {", ".join(sorted(unknown))}')
+        self.fail_fast = fail_fast
+        self.partition: Optional[str] = None
+        self.findings: List[NVS_Finding] = []
+        self.used_namespaces: Dict[int, Optional[str]] = {}
+        self.found_namespaces: Dict[int, str] = {}
+
+    def report(self, finding: NVS_Finding) -> None:
+        self.findings.append(finding)
+        if self.fail_fast and finding.severity == 'error':
+            raise _Stop_Check()
+
+    def check(self, nvs_partition: NVS_Partition) -> List[NVS_Finding]:
+        """Runs the selected checks and returns the findings
+        """
+        self.partition = nvs_partition.name
+        self.findings = []
+        self.used_namespaces = {}
+        self.found_namespaces = {}
+        try:
+            self._check(nvs_partition)
+        except _Stop_Check:
+            pass
+        return self.findings
+
+    def _check(self, nvs_partition: NVS_Partition) -> None:
+        if 'size' in self.checks:
+            # Partition size check
+            check_partition_size(nvs_partition, self.nvs_log, self.report)
+
+            # Free/empty page check
+            check_empty_page_present(nvs_partition, self.nvs_log, self.report)
+
+        seen_written_entires_all: Dict[str, List[NVS_Entry]] = {}
+
+        # Loop through all pages in the partition
+        for page in nvs_partition.pages:
+            # page: NVS_Page
+            seen_written_entires = self.check_page(page)
+
+            # Collect all seen written entries
+            for key in seen_written_entires:
+                if key in seen_written_entires_all:
+                    seen_written_entires_all[key].extend(seen_written_entires[key])
+                else:
+                    seen_written_entires_all[key] = seen_written_entires[key]
+
+        if 'dup' in self.checks:
+            # Duplicate entry check (2) - same key, different index
+            duplicates = filter_entry_duplicates(seen_written_entires_all)
+            # Print duplicate entries
+            print_entry_duplicates(duplicates, self.nvs_log, self.report, self.partition)
+
+        self.nvs_log.info()  # Empty line
+
+        # Blob checks
+        if 'blob' in self.checks:
+            self.check_blobs(nvs_partition.index())
+
+        # Namespace checks
+        if 'ns' in self.checks:
+            self.check_namespaces()
+
+    def check_page(self, nvs_page: NVS_Page) -> Dict[str, List[NVS_Entry]]:
+        """Checks the page header and all entries of the page, returns written entries of the page by key
+        """
+        # Verify all CRC32 of the page (header and written entries) at once
+        crc_mismatches = nvs_page.verify_crcs() if 'crc' in self.checks else []
 
-    # Unused namespace index check
-    for unused_ns in found_namespaces:
-        nvs_log.info(
-            nvs_log.yellow('Found unused namespace.'),
-            f'Namespace index: {unused_ns:03d}',
-            f'[{found_namespaces[unused_ns]}]',
-        )
+        # Print a page header
+        if nvs_page.header['status'] == 'Empty':
+            if 'page' in self.checks:
+                # Check if a page is truly empty
+                check_empty_page_content(nvs_page, self.nvs_log, self.report, self.partition)
+            else:
+                self.nvs_log.info(self.nvs_log.cyan(f'Page {nvs_page.header["status"]}'))
+        elif 'crc' in self.checks:
+            # Check a page header CRC32
+            check_page_crc(nvs_page, self.nvs_log, crc_mismatches, self.report, self.partition)
+        else:
+            self.nvs_log.info(self.nvs_log.cyan(f'Page no. {nvs_page.header["page_index"]}'))
 
+        # Check all entries in a page
+        return self.check_page_entries(nvs_page, crc_mismatches)
+
+    def check_page_entries(
+        self, nvs_page: NVS_Page, crc_mismatches: Optional[List[NVS_CRC_Mismatch]] = None
+    ) -> Dict[str, List[NVS_Entry]]:
+        """Checks entries in the given page (entry state, children CRC32, entry type, span and gathers namespaces)
+
+        `crc_mismatches` are results of `nvs_page.verify_crcs()` if already known
+        """
+        seen_written_entires: Dict[str, List[NVS_Entry]] = {}
+        if crc_mismatches is None:
+            crc_mismatches = nvs_page.verify_crcs() if 'crc' in self.checks else []
+        entry_crc_mismatches = {(m.entry, m.kind): m for m in crc_mismatches if m.entry is not None}
+        check_dup = 'dup' in self.checks
+        check_page = 'page' in self.checks
+        page_no = _page_number(nvs_page)
+
+        nvs_log = self.nvs_log
+        for entry in nvs_page.entries:
+            # entry: NVS_Entry
+            if not entry.is_empty:  # Free entries are shared between pages
+                entry.page = nvs_page
 
-def reset_global_variables() -> None:
-    """Global variables need to be cleared out before calling `integrity_check()` multiple times from a script
-    (e.g. when running tests) to avoid incorrect output
-    """
-    global used_namespaces, found_namespaces, blobs, blob_chunks
-    used_namespaces = {}
-    found_namespaces = {}
-    blobs = {}
-    blob_chunks = []
+            # Entries stored in 'page.entries' are primitive data types, blob indexes or string/blob data
 
+            # Variable length values themselves occupy whole 32 bytes (therefore metadata values are meaningless)
+            # and are stored in as entries inside string/blob data entry 'entry.children' list
 
-def integrity_check(nvs_partition: NVS_Partition, nvs_log: NVS_Logger) -> None:
-    """Function for multi-stage integrity check of a NVS partition
-    """
-    # Partition size check
-    check_partition_size(nvs_partition, nvs_log)
+            # Duplicate entry check (1) - same key, different index - find duplicates
+            if check_dup:
+                seen_written_entires = identify_entry_duplicates(entry, seen_written_entires)
+
+            # Entry state check - doesn't check variable length values (metadata such as state are meaningless as all 32 bytes are pure data)
+            if entry.is_empty:
+                if entry.state == 'Written':
+                    if check_page:
+                        nvs_log.info(
+                            nvs_log.red(
+                                f' Entry #{entry.index:03d} is reported as Written but it is empty!'
+                            )
+                        )
+                        self.report(NVS_Finding(
+                            'written_entry_empty', 'error', 'Entry is reported as Written but it is empty!',
+                            self.partition, page_no, entry.index,
+                        ))
+                    continue
+                elif entry.state == 'Erased' and check_page:
+                    nvs_log.info(
+                        nvs_log.yellow(
+                            f' Entry #{entry.index:03d} is reported as Erased but it is empty! (Only entries reported as Empty should be empty)'
+                        )
+                    )
+                    self.report(NVS_Finding(
+                        'erased_entry_empty', 'warning', 'Entry is reported as Erased but it is empty!',
+                        self.partition, page_no, entry.index,
+                    ))
 
-    # Free/empty page check
-    check_empty_page_present(nvs_partition, nvs_log)
+            if entry.state == 'Written':
+                # Entry CRC32 check
+                mismatch = entry_crc_mismatches.get((entry.index, 'entry'))
+                if mismatch is not None:
+                    nvs_log.info(
+                        nvs_log.red(
+                            f' Entry #{entry.index:03d} {entry.key} has wrong CRC32!{"": <5}'
+                        ),
+                        f'Written:',
+                        nvs_log.red(f'{mismatch.original:x}'),
+                        f'Generated:',
+                        nvs_log.green(f'{mismatch.computed:x}'),
+                    )
+                    self.report(NVS_Finding(
+                        'entry_crc', 'error', f'Entry {entry.key} has wrong CRC32!', self.partition, page_no,
+                        entry.index, entry.namespace, entry.key, mismatch.computed, mismatch.original,
+                    ))
+
+                # Entry children CRC32 check
+                mismatch = entry_crc_mismatches.get((entry.index, 'data'))
+                if mismatch is not None:
+                    nvs_log.info(
+                        nvs_log.red(
+                            f' Entry #{entry.index:03d} {entry.key} data (string, blob) has wrong CRC32!'
+                        ),
+                        f'Written:',
+                        nvs_log.red(f'{mismatch.original:x}'),
+                        f'Generated:',
+                        nvs_log.green(f'{mismatch.computed:x}'),
+                    )
+                    self.report(NVS_Finding(
+                        'data_crc', 'error', f'Entry {entry.key} data (string, blob) has wrong CRC32!', self.partition,
+                        page_no, entry.index, entry.namespace, entry.key, mismatch.computed, mismatch.original,
+                    ))
+
+                if check_page:
+                    # Entry type check
+                    if entry.type_name not in [
+                        nvs_const.item_type[key] for key in nvs_const.item_type
+                    ]:
+                        nvs_log.info(
+                            nvs_log.yellow(
+                                f' Type of entry #{entry.index:03d} {entry.key} is unrecognized!'
+                            ),
+                            f'Type: {entry.type_name}',
+                        )
+                        self.report(NVS_Finding(
+                            'unknown_type', 'warning', f'Type of entry {entry.key} is unrecognized ({entry.type_name})',
+                            self.partition, page_no, entry.index, entry.namespace, entry.key,
+                        ))
+
+                    # Span check
+                    if (
+                        entry.index + entry.span - 1
+                        >= int(nvs_const.page_size / nvs_const.entry_size) - 2
+                    ):
+                        nvs_log.info(
+                            nvs_log.red(
+                                f' Variable length entry #{entry.index:03d} {entry.key} is out of bounds!'
+                            )
+                        )
+                        self.report(NVS_Finding(
+                            'span_out_of_bounds', 'error', f'Variable length entry {entry.key} is out of bounds!',
+                            self.partition, page_no, entry.index, entry.namespace, entry.key,
+                        ))
+                    # Spanned entry state checks
+                    elif entry.span > 1:
+                        parent_state = entry.state
+                        for kid in entry.children:
+                            if parent_state != kid.state:
+                                nvs_log.info(
+                                    nvs_log.yellow(' Inconsistent data state!'),
+                                    f'Entry #{entry.index:03d} {entry.key} state: {parent_state},',
+                                    f'Data entry #{kid.index:03d} {entry.key} state: {kid.state}',
+                                )
+                                self.report(NVS_Finding(
+                                    'inconsistent_data_state', 'warning',
+                                    f'Data entry #{kid.index:03d} state {kid.state} differs from entry state {parent_state}',
+                                    self.partition, page_no, entry.index, entry.namespace, entry.key,
+                                ))
+
+                # Gather namespaces (blobs are linked by the partition index)
+                if entry.namespace == 0:
+                    self.found_namespaces[entry.data['value']] = entry.key
+                else:
+                    self.used_namespaces[entry.namespace] = None
+
+        return seen_written_entires
+
+    def assemble_blobs(self, nvs_index: NVS_Index) -> None:
+        """Reports blob chunks which could not be linked to a blob index (chunks are linked by the partition index)
+        """
+        for chunk in nvs_index.orphan_chunks:
+            # chunk: NVS_Entry
+            blob_index = nvs_index.blob_indexes.get((chunk.namespace, chunk.key))  # type: ignore
+            if blob_index is None:
+                # Blob chunk without blob index check
+                self.nvs_log.info(
+                    self.nvs_log.red(f'Blob {chunk.key} chunk has no blob index!'),
+                    f'Namespace index: {chunk.namespace:03d}',
+                    f'[{self.found_namespaces.get(chunk.namespace, "undefined")}],',
+                    f'Chunk Index: {chunk.chunk_index:03d}',
+                )
+                self.report(NVS_Finding(
+                    'blob_orphan_chunk', 'error', f'Blob {chunk.key} chunk {chunk.chunk_index:03d} has no blob index!',
+                    self.partition, _page_number(chunk.page), chunk.index, chunk.namespace, chunk.key,
+                ))
+            else:
+                # Chunk of another version of the blob (left over by an interrupted write)
+                self.nvs_log.info(
+                    self.nvs_log.yellow(f'Blob {chunk.key} chunk is out of its blob index range!'),
+                    f'Namespace index: {chunk.namespace:03d}',
+                    f'[{self.found_namespaces.get(chunk.namespace, "undefined")}],',
+                    f'Chunk Index: {chunk.chunk_index:03d}',
+                )
+                self.report(NVS_Finding(
+                    'blob_chunk_out_of_range', 'warning',
+                    f'Blob {chunk.key} chunk {chunk.chunk_index:03d} is out of its blob index range '
+                    + f'{blob_index.data["chunk_start"]:03d}..'
+                    + f'{blob_index.data["chunk_start"] + blob_index.data["chunk_count"] - 1:03d}!',
+                    self.partition, _page_number(chunk.page), chunk.index, chunk.namespace, chunk.key,
+                ))
+
+    def check_blob_data(self, nvs_index: NVS_Index) -> None:
+        """Checks every blob in a single pass over its chunks linked by the partition index:
+        chunk range of the blob index, missing chunks, CRC32 of chunk data (unless the crc stage runs)
+        and the declared size
+        """
+        check_crc = 'crc' not in self.checks
+        for blob_key, blob_index in nvs_index.blob_indexes.items():
+            blob_chunks = nvs_index.blob_chunks[blob_key]
+            blob_size = blob_index.data['size']
+            chunk_start = blob_index.data['chunk_start']
+            chunk_count = blob_index.data['chunk_count']
+            blob_page = _page_number(blob_index.page)
+
+            # Chunk range check, an empty blob still has a single (empty) chunk
+            range_end = BLOB_VERSION_END.get(chunk_start)
+            if range_end is None or chunk_start + chunk_count > range_end or chunk_count == 0:
+                self.nvs_log.info(
+                    self.nvs_log.red(f'Blob {blob_index.key} has invalid chunk range!'),
+                    f'Namespace index: {blob_index.namespace:03d}',
+                    f'Chunk start: {chunk_start:03d}, Chunk count: {chunk_count:03d}, Size: {blob_size}',
+                )
+                self.report(NVS_Finding(
+                    'blob_chunk_range', 'error',
+                    f'Blob {blob_index.key} has invalid chunk range (start {chunk_start}, count {chunk_count}, size {blob_size})',
+                    self.partition, blob_page, blob_index.index, blob_index.namespace, blob_index.key,
+                ))
+
+            data_size = 0
+            for i, chunk in enumerate(blob_chunks):
+                # chunk: NVS_Entry
+                # Blob missing chunk check
+                if chunk is None:
+                    self.nvs_log.info(
+                        self.nvs_log.red(f'Blob {blob_index.key} is missing a chunk!'),
+                        f'Namespace index: {blob_index.namespace:03d}',
+                        f'[{self.found_namespaces.get(blob_index.namespace, "undefined")}],',
+                        f'Chunk Index: {i:03d}',
+                    )
+                    self.report(NVS_Finding(
+                        'blob_missing_chunk', 'error', f'Blob {blob_index.key} is missing chunk {i:03d}!',
+                        self.partition, blob_page, blob_index.index, blob_index.namespace, blob_index.key,
+                    ))
+                    continue
+
+                data_size += chunk.data['size']
+
+                # Blob chunk CRC32 check, already reported by the crc stage when it runs
+                if check_crc and chunk.span > 1 and chunk.crc_data_original != chunk.crc_data_computed:
+                    self.nvs_log.info(
+                        self.nvs_log.red(f'Blob {blob_index.key} chunk has wrong CRC32!'),
+                        f'Namespace index: {blob_index.namespace:03d}',
+                        f'Chunk Index: {chunk.chunk_index:03d}',
+                        f'Written:',
+                        self.nvs_log.red(f'{chunk.crc_data_original:x}'),
+                        f'Generated:',
+                        self.nvs_log.green(f'{chunk.crc_data_computed:x}'),
+                    )
+                    self.report(NVS_Finding(
+                        'blob_chunk_crc', 'error',
+                        f'Blob {blob_index.key} chunk {chunk.chunk_index:03d} has wrong CRC32!', self.partition,
+                        _page_number(chunk.page), chunk.index, chunk.namespace, chunk.key,
+                        chunk.crc_data_computed, chunk.crc_data_original,
+                    ))
+
+            # Blob size check
+            if data_size < blob_size:
+                self.nvs_log.info(
+                    self.nvs_log.red(f'Blob {blob_index.key} is missing {blob_size - data_size} B of data!'),
+                    f'Namespace index: {blob_index.namespace:03d}',
+                )
+                self.report(NVS_Finding(
+                    'blob_missing_data', 'error', f'Blob {blob_index.key} is missing {blob_size - data_size} B of data!',
+                    self.partition, blob_page, blob_index.index, blob_index.namespace, blob_index.key,
+                ))
+            elif data_size > blob_size:
+                self.nvs_log.info(
+                    self.nvs_log.red(f'Blob {blob_index.key} has {data_size - blob_size} B more data than declared!'),
+                    f'Namespace index: {blob_index.namespace:03d}',
+                )
+                self.report(NVS_Finding(
+                    'blob_size_mismatch', 'error',
+                    f'Blob {blob_index.key} has {data_size - blob_size} B more data than declared!',
+                    self.partition, blob_page, blob_index.index, blob_index.namespace, blob_index.key,
+                ))
+
+    def check_blobs(self, nvs_index: NVS_Index) -> None:
+        # Blob chunks without blob index
+        self.assemble_blobs(nvs_index)
+        # Blob data check
+        self.check_blob_data(nvs_index)
+
+    def check_namespaces(self) -> None:
+        """Checks namespaces (entries using undefined namespace indexes, unused namespaces)
+        """
+        # Undefined namespace index check
+        for used_ns in self.used_namespaces:
+            key = self.found_namespaces.pop(used_ns, None)
+            if key is None:
+                self.nvs_log.info(
+                    self.nvs_log.red('Undefined namespace index!'),
+                    f'Namespace index: {used_ns:03d}',
+                    f'[undefined]',
+                )
+                self.report(NVS_Finding(
+                    'undefined_namespace', 'error', 'Undefined namespace index!', self.partition, namespace=used_ns
+                ))
+
+        # Unused namespace index check
+        for unused_ns in self.found_namespaces:
+            self.nvs_log.info(
+                self.nvs_log.yellow('Found unused namespace.'),
+                f'Namespace index: {unused_ns:03d}',
+                f'[{self.found_namespaces[unused_ns]}]',
+            )
+            self.report(NVS_Finding(
+                'unused_namespace', 'warning', f'Found unused namespace {self.found_namespaces[unused_ns]}.',
+                self.partition, namespace=unused_ns,
+            ))
 
-    seen_written_entires_all: Dict[str, List[NVS_Entry]] = {}
 
-    # Loop through all pages in the partition
-    for page in nvs_partition.pages:
-        # page: NVS_Page
+class _Page_Check(NamedTuple):
+    """Cached results of a single page (see `IncrementalChecker`)
+    """
+    findings: List[NVS_Finding]
+    seen: Dict[str, List[NVS_Entry]]  # Written entries by key
+    found_namespaces: Dict[int, str]
+    used_namespaces: Dict[int, Optional[str]]
 
-        # Print a page header
-        if page.header['status'] == 'Empty':
-            # Check if a page is truly empty
-            check_empty_page_content(page, nvs_log)
-        else:
-            # Check a page header CRC32
-            check_page_crc(page, nvs_log)
 
-        # Check all entries in a page
-        seen_written_entires = check_page_entries(page, nvs_log)
+class IncrementalChecker(IntegrityChecker):
+    """Integrity check which keeps results of every page and the cross-page tables (duplicates by key,
+    namespaces, the partition index) between runs, so after a change only the changed pages are checked again
 
-        # Collect all seen written entries
-        for key in seen_written_entires:
-            if key in seen_written_entires_all:
-                seen_written_entires_all[key].extend(seen_written_entires[key])
+    Produces findings only (no text report). Start with `check()`, then call `recheck()` with numbers
+    of the changed pages after every change of the partition (e.g. those returned by `NVS_Partition.update()`).
+    """
+    def __init__(self, checks: Iterable[str] = CHECKS):
+        super().__init__(None, checks)
+        self._pages: List[Optional[_Page_Check]] = []
+        self._seen: Dict[str, Dict[int, List[NVS_Entry]]] = {}  # Key -> page number -> written entries
+        self._duplicates: Dict[str, List[NVS_Finding]] = {}
+
+    def check(self, nvs_partition: NVS_Partition) -> List[NVS_Finding]:
+        """Checks all pages of the partition and keeps the results
+        """
+        self._pages = [None] * len(nvs_partition.pages)
+        self._seen = {}
+        self._duplicates = {}
+        return self.recheck(nvs_partition, range(len(nvs_partition.pages)))
+
+    def recheck(self, nvs_partition: NVS_Partition, changed_pages: Iterable[int]) -> List[NVS_Finding]:
+        """Checks the changed pages (page numbers) again, patches the cross-page tables
+        and returns findings of the whole partition
+        """
+        self.partition = nvs_partition.name
+        page_count = len(nvs_partition.pages)
+        changed = set(changed_pages)
+        # Pages added or removed by a change of the partition size
+        changed.update(range(min(page_count, len(self._pages)), max(page_count, len(self._pages))))
+        self._pages.extend([None] * (page_count - len(self._pages)))
+
+        affected_keys: Dict[str, None] = {}  # Ordered like the keys of a full check
+        for page_no in sorted(changed):
+            old = self._pages[page_no]
+            if old is not None:
+                for key in old.seen:
+                    del self._seen[key][page_no]
+                affected_keys.update(dict.fromkeys(old.seen))
+            if page_no >= page_count:
+                continue
+            new = self._check_page(nvs_partition.pages[page_no])
+            self._pages[page_no] = new
+            for key, entries in new.seen.items():
+                self._seen.setdefault(key, {})[page_no] = entries
+            affected_keys.update(dict.fromkeys(new.seen))
+        del self._pages[page_count:]
+
+        # Duplicates are only looked for among entries with the affected keys
+        for key in affected_keys:
+            entries_by_page = self._seen.get(key)
+            if not entries_by_page:
+                self._seen.pop(key, None)
+                self._duplicates.pop(key, None)
+                continue
+            entries = [entry for page_no in sorted(entries_by_page) for entry in entries_by_page[page_no]]
+            duplicates = filter_entry_duplicates({key: entries})
+            if duplicates:
+                findings: List[NVS_Finding] = []
+                print_entry_duplicates(duplicates, self.nvs_log, findings.append, self.partition)
+                self._duplicates[key] = findings
             else:
-                seen_written_entires_all[key] = seen_written_entires[key]
+                self._duplicates.pop(key, None)
+
+        return self._collect(nvs_partition)
+
+    def _check_page(self, nvs_page: NVS_Page) -> _Page_Check:
+        self.findings = []
+        self.found_namespaces = {}
+        self.used_namespaces = {}
+        seen = self.check_page(nvs_page)
+        return _Page_Check(self.findings, seen, self.found_namespaces, self.used_namespaces)
+
+    def _first_seen(self, key: str) -> Tuple[int, int]:
+        page_no = min(self._seen[key])
+        return page_no, self._seen[key][page_no][0].index
+
+    def _collect(self, nvs_partition: NVS_Partition) -> List[NVS_Finding]:
+        """Puts findings together in the order of a full check, partition wide checks run again
+        """
+        self.findings = []
+        self.found_namespaces = {}
+        self.used_namespaces = {}
+        if 'size' in self.checks:
+            check_partition_size(nvs_partition, self.nvs_log, self.report)
+            check_empty_page_present(nvs_partition, self.nvs_log, self.report)
+
+        for page_check in self._pages:
+            if page_check is None:
+                continue
+            self.findings.extend(page_check.findings)
+            self.found_namespaces.update(page_check.found_namespaces)
+            self.used_namespaces.update(page_check.used_namespaces)
 
-    # Duplicate entry check (2) - same key, different index
-    duplicates = filter_entry_duplicates(seen_written_entires_all)
-    # Print duplicate entries
-    print_entry_duplicates(duplicates, nvs_log)
+        for key in sorted(self._duplicates, key=self._first_seen):
+            self.findings.extend(self._duplicates[key])
 
-    nvs_log.info()  # Empty line
+        if 'blob' in self.checks:
+            self.check_blobs(nvs_partition.index())
+        if 'ns' in self.checks:
+            self.check_namespaces()
+        return self.findings
 
-    # Blob checks
-    check_blobs(nvs_log)
 
-    # Namespace checks
-    check_namespaces(nvs_log)
+def reset_global_variables() -> None:
+    """Kept for compatibility, `integrity_check()` no longer keeps any global state
+    """
+
 
-    reset_global_variables()
+def integrity_check(
+    nvs_partition: NVS_Partition,
+    nvs_log: Optional[NVS_Logger],
+    checks: Iterable[str] = CHECKS,
+    fail_fast: bool = False,
+) -> List[NVS_Finding]:
+    """Function for multi-stage integrity check of a NVS partition, see `IntegrityChecker`
+    """
+    return IntegrityChecker(nvs_log, checks, fail_fast).check(nvs_partition)
+
+
+def open_partitions(
+    path: str,
+    flash_image: bool = False,
+    name: Optional[str] = None,
+    table_offset: int = nvs_parser.PARTITION_TABLE_OFFSET,
+    cache_dir: Optional[str] = None,
+    workers: int = 1,
+) -> List[NVS_Partition]:
+    """Opens a partition dump, or NVS partitions of a full flash image (only the one called `name` if given),
+    decoded partitions are reused from `cache_dir` if set
+    """
+    if flash_image:
+        regions: List[Tuple[Optional[str], int, Optional[int]]] = [
+            (info.name, info.offset, info.size) for info in nvs_parser.find_nvs_partitions(path, name, table_offset)
+        ]
+    else:
+        regions = [(None, 0, None)]
+    partitions = []
+    for partition_name, offset, length in regions:
+        if cache_dir:
+            nvs = nvs_cache.NVS_Cache(cache_dir).load(path, offset=offset, length=length)
+        else:
+            nvs = NVS_Partition.from_file(path, offset, length, workers=workers)
+        if partition_name is not None:
+            nvs.name = partition_name
+        partitions.append(nvs)
+    return partitions
+
+
+def check_file(
+    path: str, checks: Iterable[str] = CHECKS, fail_fast: bool = False, **options: Any
+) -> List[NVS_Finding]:
+    """Opens (see `open_partitions()` for `options`) and checks a partition dump or flash image
+    without a text report, a file which can not be parsed is reported as a 'parse_error' finding
+    """
+    try:
+        partitions = open_partitions(path, **options)
+    except (OSError, ValueError) as e:
+        return [NVS_Finding('parse_error', 'error', str(e), os.path.basename(path))]
+    findings: List[NVS_Finding] = []
+    checker = IntegrityChecker(None, checks, fail_fast)
+    for nvs in partitions:
+        findings.extend(checker.check(nvs))
+        if fail_fast and any(finding.severity == 'error' for finding in findings):
+            break
+    return findings
+
+
+def check_files(
+    paths: Iterable[str], jobs: int = 1, **options: Any
+) -> Iterator[Tuple[str, List[NVS_Finding]]]:
+    """Checks many files (see `check_file()`) in `jobs` worker processes (0 = one per CPU, 1 = no worker processes),
+    yields (path, findings) in the order the files are finished
+    """
+    if jobs == 1:
+        for path in paths:
+            yield path, check_file(path, **options)
+        return
+    with ProcessPoolExecutor(jobs or None) as pool:
+        futures = {pool.submit(check_file, path, **options): path for path in paths}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
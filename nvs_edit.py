@@ -1,12 +1,8 @@
 import os
-import sys
 import csv
 import time
-import json
-import base64
 import tempfile
 import subprocess
-import io
 import argparse
 import tkinter as tk
 import tkinter.font as tkfont
@@ -14,6 +10,7 @@ from tkinter import ttk, filedialog, messagebox
 
 # 必须子模块直接导入
 import nvs_parser as nvs_parser
+import nvs_cache as nvs_cache
 import nvs_logger as nvs_logger
 import nvs_partition_gen as nvs_gen_mod
 
@@ -31,6 +28,7 @@ class NVS_Editor:
         self.partition_size = 0x5000
         self.current_file = None
         self.nvs_data = []
+        self.nvs_index = {}  # (命名空间, 键名) -> 条目列表，避免线性查找
         self.namespace_map = {}  # 存储命名空间映射 {namespace_index: namespace_name}
         
         # 创建菜单栏
@@ -139,6 +137,32 @@ class NVS_Editor:
         )
         messagebox.showinfo(title="关于 NVS Partition Editor", message=info)
 
+    def _load_partition(self, file_path):
+        """读取分区文件，返回 (命名空间映射, 条目列表)，返回时文件映射已释放"""
+        # 直接使用已导入的模块（内存映射文件，避免整体读入内存）
+        cache_dir = os.environ.get("NVS_CACHE_DIR")
+        if cache_dir:
+            # 重复打开同一镜像时复用已解析的结果
+            nvs_obj = nvs_cache.NVS_Cache(cache_dir).load(file_path)
+        else:
+            nvs_obj = self.nvs_parser.NVS_Partition.from_file(file_path)
+        # 值均复制为 bytes，退出时关闭分区，文件不再被映射（Windows 下才能覆盖保存）
+        with nvs_obj:
+            # 命名空间映射直接取自分区索引
+            namespace_map = nvs_obj.namespaces()
+            nvs_index = nvs_obj.index()
+            # 只加载设备固件可见的条目（按页序号排序，旧副本已被覆盖），字符串和 blob 的值由解析器拼接
+            # blob_data 分块已由对应的 blob_index 拼接，不单独列出
+            loaded = []
+            for entry in nvs_index.live:
+                if not entry.key:
+                    continue
+                value = nvs_index.value(entry)
+                if isinstance(value, self.nvs_parser.NVS_Value):
+                    value = value.tobytes()
+                loaded.append((entry.namespace, entry.key, entry.type_name, value))
+        return namespace_map, loaded
+
     def open_partition(self):
         file_path = filedialog.askopenfilename(
             title="打开NVS分区文件",
@@ -148,28 +172,12 @@ class NVS_Editor:
             return
         
         try:
-            json_file = None
             # 获取分区大小
             self.partition_size = os.path.getsize(file_path)
             self.status.set(f"解析分区: {file_path}...")
             self.master.update()
             
-            # 直接使用已导入的模块
-            with open(file_path, 'rb') as f:
-                partition = f.read()
-            nvs_obj = self.nvs_parser.NVS_Partition(os.path.basename(file_path), bytearray(partition))
-            buf = io.StringIO()
-            old_stdout = sys.stdout
-            try:
-                sys.stdout = buf
-                self.nvs_logger.print_json(nvs_obj)
-            finally:
-                sys.stdout = old_stdout
-            json_text = buf.getvalue()
-            try:
-                data = json.loads(json_text)
-            except json.JSONDecodeError as e:
-                raise ValueError(f"JSON解析错误: {e}\n原始内容片段:\n{json_text[:500]}...")
+            namespace_map, loaded = self._load_partition(file_path)
         except Exception:
             messagebox.showerror("错误", "解析分区文件失败，请检查文件格式和内容")
             self.status.set("错误")
@@ -177,28 +185,13 @@ class NVS_Editor:
 
         # 处理并显示数据
         self.nvs_data = []
-        self.namespace_map = {}  # 重置命名空间映射
+        self.nvs_index = {}
+        self.namespace_map = namespace_map
         self.tree.delete(*self.tree.get_children())
-        
-        # 首先处理命名空间条目
-        if "pages" in data:
-            for page in data["pages"]:
-                if "entries" in page:
-                    for entry in page["entries"]:
-                        if entry.get("state") == "Written" and entry.get("key") and entry.get("metadata", {}).get("namespace") == 0:
-                            # 这是命名空间定义条目
-                            namespace_name = entry["key"]
-                            namespace_index = entry["data"]["value"]
-                            self.namespace_map[namespace_index] = namespace_name
-        
-        # 然后处理所有条目
-        if "pages" in data:
-            for page in data["pages"]:
-                if "entries" in page:
-                    for entry in page["entries"]:
-                        if entry.get("state") == "Written" and entry.get("key") and entry.get("metadata", {}).get("namespace") != 0:
-                            # 这是普通数据条目
-                            self._process_entry(entry)
+
+        # 处理所有条目
+        for namespace_index, key, entry_type, value in loaded:
+            self._process_entry(namespace_index, key, entry_type, value)
         
         # 在加载完所有条目后自动按当前设置排序并刷新视图
         try:
@@ -208,12 +201,6 @@ class NVS_Editor:
 
         self.current_file = file_path
         self.status.set(f"共加载: {file_path} | 条目数: {len(self.nvs_data)}")
-        # 仅当临时 json_file 存在时删除
-        try:
-            if json_file and os.path.exists(json_file):
-                os.unlink(json_file)
-        except Exception:
-            pass
     
     def import_from_csv(self):
         """从CSV文件导入数据，遵循官方命名空间分组规则"""
@@ -228,6 +215,7 @@ class NVS_Editor:
         try:
             # 清空现有数据
             self.nvs_data = []
+            self.nvs_index = {}
             self.namespace_map = {}
             self.tree.delete(*self.tree.get_children())
 
@@ -267,6 +255,7 @@ class NVS_Editor:
                         "raw": {}
                     }
                     self.nvs_data.append(entry)
+                    self._index_entry(entry)
 
                     # 添加到树状视图
                     display_value = row['value']
@@ -361,48 +350,23 @@ class NVS_Editor:
             messagebox.showerror("错误", f"导出CSV失败:\n{str(e)}")
             # 避免将长错误信息显示在状态栏
             self.status.set("错误")
-    def _process_entry(self, entry):
+    def _process_entry(self, namespace_index, key, entry_type, value):
         """处理单个NVS条目并添加到树状视图"""
-        if not isinstance(entry, dict):
-            return
-            
-        key = entry.get("key", "")
         if not key:
             return
-            
-        namespace_index = entry.get("metadata", {}).get("namespace", 0)
+
         namespace = self.namespace_map.get(namespace_index, f"ns_{namespace_index}")
-        
-        entry_type = entry.get("metadata", {}).get("type", "unknown")
-        value = entry.get("data", {}).get("value", "")
+
+        # 多分块 blob 以 blob_index 的拼接结果显示，保存时按 blob_data 处理
+        if entry_type == "blob_index":
+            entry_type = "blob_data"
 
         display_value = str(value)
 
-        if entry_type == "blob_index":
-            print("跳过blob_index")
-            print(f"key:{key} namespace:{namespace} value:{value}")
-            self.status.set(f"跳过blob_index {key}...")
-            self.master.update()
-            return
-        # if entry_type == "blob_data":
-        #     self.status.set(f"跳过blob_data {key}...")
-        #     return
-        
         # 特殊处理 blob_data 和 string 类型
-        if entry_type in ["blob_data", "string"] and "children" in entry:
-            # 处理子条目中的实际数据
+        if entry_type in ["blob_data", "string"] and isinstance(value, bytes):
+            raw_data = value
             try:
-                # 收集所有子条目的原始数据
-                raw_data = b''
-                for child in entry.get("children", []):
-                    # 解码 base64 格式的原始数据
-                    child_raw = child.get("raw", "")
-                    if child_raw:
-                        # 移除填充字符并解码
-                        child_raw = child_raw.rstrip('=')
-                        raw_data += base64.b64decode(child_raw + '=' * (4 - len(child_raw) % 4))
-                        # print(raw_data)
-                
                 # 根据类型处理数据
                 if entry_type == "string":
                     # 字符串类型：转换为UTF-8字符串
@@ -414,21 +378,13 @@ class NVS_Editor:
                         value = raw_data
                     except UnicodeDecodeError:
                         # 如果失败，转为十六进制表示
-                        
-                        hex_str = raw_data.hex()
-                        # 尝试提取可能的UTF-8部分
-                        value = f"{hex_str}"
-                        try:
-                            # 从十六进制中提取非FFFF部分
-                            clean_hex = hex_str.split('ffffffff')[0]  # 去除填充
-                            display_value = bytes.fromhex(clean_hex).decode('utf-8')
-                        except:
-                            display_value = f"{hex_str}"
-                    
+                        value = raw_data.hex()
+                        display_value = value
+
             except Exception as e:
                 print(f"处理子条目数据失败: {str(e)}")
                 value = "<二进制数据解码失败>"
-                
+
         elif isinstance(value, (int, float)):
             value = str(value)
         
@@ -439,9 +395,10 @@ class NVS_Editor:
             "namespace_index": namespace_index,
             "type": entry_type,
             "value": value,
-            "raw": entry
+            "raw": {}
         }
         self.nvs_data.append(item_data)
+        self._index_entry(item_data)
         
         # 截断长值用于显示
         if len(display_value) > 100:
@@ -655,11 +612,9 @@ class NVS_Editor:
             }
             
             # 检查是否已存在
-            for item in self.tree.get_children():
-                if (self.tree.item(item, "text") == dialog.key and 
-                    self.tree.item(item, "values")[1] == dialog.namespace):
-                    messagebox.showwarning("添加", "该名在指定命名空间中已存在!")
-                    return
+            if self._find_entry(dialog.namespace, dialog.key) is not None:
+                messagebox.showwarning("添加", "该名在指定命名空间中已存在!")
+                return
             
             # 添加显示值（截断长字符串）
             display_value = dialog.value
@@ -667,6 +622,7 @@ class NVS_Editor:
                 display_value = display_value[:100] + "..."
             
             self.nvs_data.append(new_entry)
+            self._index_entry(new_entry)
             self.tree.insert("", "end", text=dialog.key, 
                             values=(dialog.key, dialog.namespace, dialog.data_type, display_value),
                             tags=(str(self._get_namespace_index(dialog.namespace)),))
@@ -747,6 +703,25 @@ class NVS_Editor:
         # 直接复用 sort_entries 的逻辑即可
         self.sort_entries()
 
+    def _index_entry(self, entry):
+        """将条目加入 (命名空间, 键名) 索引"""
+        self.nvs_index.setdefault((entry["namespace"], entry["key"]), []).append(entry)
+
+    def _unindex_entry(self, entry):
+        """从 (命名空间, 键名) 索引中移除条目"""
+        entries = self.nvs_index.get((entry["namespace"], entry["key"]), [])
+        for i, e in enumerate(entries):
+            if e is entry:
+                del entries[i]
+                break
+        if not entries:
+            self.nvs_index.pop((entry["namespace"], entry["key"]), None)
+
+    def _find_entry(self, namespace, key):
+        """按 (命名空间, 键名) 查找条目，不存在时返回 None"""
+        entries = self.nvs_index.get((namespace, key))
+        return entries[0] if entries else None
+
     def _get_namespace_index(self, namespace_name):
         """获取命名空间的索引值"""
         for ns_index, ns_name in self.namespace_map.items():
@@ -770,11 +745,8 @@ class NVS_Editor:
         current_type = self.tree.item(item, "values")[2]
         
         # 查找原始数据（完整值）
-        full_value = ""
-        for entry in self.nvs_data:
-            if entry["key"] == key and entry["namespace"] == current_namespace:
-                full_value = entry["value"]
-                break
+        found = self._find_entry(current_namespace, key)
+        full_value = found["value"] if found is not None else ""
         
         # 获取所有命名空间作为选项
         namespace_options = list(set(entry["namespace"] for entry in self.nvs_data))
@@ -789,33 +761,32 @@ class NVS_Editor:
             full_value
         )
         
-        if dialog.result:
-            # 更新数据
-            for idx, entry in enumerate(self.nvs_data):
-                if entry["key"] == key and entry["namespace"] == current_namespace:
-                    self.nvs_data[idx]["key"] = dialog.key
-                    self.nvs_data[idx]["namespace"] = dialog.namespace
-                    self.nvs_data[idx]["namespace_index"] = self._get_namespace_index(dialog.namespace)
-                    self.nvs_data[idx]["type"] = dialog.data_type
-                    self.nvs_data[idx]["value"] = dialog.value
-                    
-                    # 更新显示值（截断长字符串）
-                    display_value = dialog.value
-                    if len(display_value) > 100:
-                        display_value = display_value[:100] + "..."
-                    
-                    # 更新树状视图
-                    self.tree.item(item, 
-                                 text=dialog.key,
-                                 values=(dialog.key, dialog.namespace, dialog.data_type, display_value),
-                                 tags=(str(self._get_namespace_index(dialog.namespace)),))
-                    # 编辑后自动排序
-                    try:
-                        self.sort_entries()
-                    except Exception:
-                        pass
-                    self.status.set(f"已更新条目: {dialog.namespace}:{dialog.key}")
-                    break
+        if dialog.result and found is not None:
+            # 更新数据（条目字典与 nvs_data 中的为同一对象）
+            self._unindex_entry(found)
+            found["key"] = dialog.key
+            found["namespace"] = dialog.namespace
+            found["namespace_index"] = self._get_namespace_index(dialog.namespace)
+            found["type"] = dialog.data_type
+            found["value"] = dialog.value
+            self._index_entry(found)
+
+            # 更新显示值（截断长字符串）
+            display_value = dialog.value
+            if len(display_value) > 100:
+                display_value = display_value[:100] + "..."
+
+            # 更新树状视图
+            self.tree.item(item,
+                         text=dialog.key,
+                         values=(dialog.key, dialog.namespace, dialog.data_type, display_value),
+                         tags=(str(self._get_namespace_index(dialog.namespace)),))
+            # 编辑后自动排序
+            try:
+                self.sort_entries()
+            except Exception:
+                pass
+            self.status.set(f"已更新条目: {dialog.namespace}:{dialog.key}")
 
     def delete_entry(self):
         selected = self.tree.selection()
@@ -831,6 +802,7 @@ class NVS_Editor:
             # 从数据中移除
             self.nvs_data = [e for e in self.nvs_data 
                            if not (e["key"] == key and e["namespace"] == namespace)]
+            self.nvs_index.pop((namespace, key), None)
             
             # 从树状视图中移除
             self.tree.delete(item)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# SPDX-FileCopyrightText: 2024 Espressif Systems (Shanghai) CO LTD
+# SPDX-License-Identifier: Apache-2.0
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+
+from nvs_parser import decode_page_row
+from nvs_parser import nvs_const
+from nvs_parser import NVS_Partition
+
+# Raw 2-bit entry states
+STATE_EMPTY = 0b11
+STATE_WRITTEN = 0b10
+STATE_ERASED = 0b00
+
+ENTRIES_PER_PAGE = nvs_const.page_size // nvs_const.entry_size - 2
+# Item types of the estimated writes, see writes_before_gc()
+WRITE_TYPES = ('int', 'string', 'blob')
+
+
+class NVS_Page_Usage(NamedTuple):
+    """Entry usage of a single page
+    """
+    page: int  # Page number (position in the partition)
+    sequence: Optional[int]  # Page sequence number, None for empty pages
+    status: str
+    written: int
+    erased: int
+    free: int
+    invalid: int
+    writable: int  # Free entries new items can be written to without a garbage collection
+    reclaimable: int  # Erased and invalid entries a garbage collection of the page would free
+
+    def toJSON(self) -> Dict[str, Any]:
+        result = self._asdict()
+        result.update(
+            written_ratio=self.written / ENTRIES_PER_PAGE,
+            erased_ratio=self.erased / ENTRIES_PER_PAGE,
+            free_ratio=self.free / ENTRIES_PER_PAGE,
+        )
+        return result
+
+
+class NVS_GC_Report(NamedTuple):
+    """Free space of a partition and how far it is from a garbage collection
+
+    New items are appended to the active page, a full page is replaced by an empty one, but the last
+    empty page is reserved for the garbage collection. Once it is the only one left, the page with most
+    erased entries is compacted into it and erased, `gc_order` lists pages in the order consecutive
+    collections would pick them (the active page is filled by new writes first and is not listed).
+    """
+    pages: List[NVS_Page_Usage]
+    active_page: Optional[int]
+    empty_pages: int
+    writable_entries: int
+    reclaimable_entries: int
+    write_size: int
+    write_type: str
+    writes_before_gc: int  # Writes of `write_size` bytes which fit before a garbage collection is forced
+    gc_order: List[int]
+
+    def toJSON(self) -> Dict[str, Any]:
+        result = self._asdict()
+        result['pages'] = [page.toJSON() for page in self.pages]
+        return result
+
+
+def writes_before_gc(capacities: List[int], size: int, item_type: str = 'string') -> int:
+    """Returns how many writes of a `size` bytes value fit into pages with the given free entries (in write order)
+
+    Integers (up to 8 B) take a single entry, strings a header entry and one entry per 32 B within a single page.
+    Blobs are split into chunks (a header entry and data entries) filling the free space of consecutive pages,
+    followed by a blob index entry.
+    """
+    if item_type not in WRITE_TYPES:
+        raise ValueError(f'Unknown item type {item_type!r} (expected one of {", ".join(WRITE_TYPES)})')
+    if item_type == 'int':
+        if size > 8:
+            raise ValueError(f'Integers take up to 8 B, not {size} B')
+        return sum(capacities)
+    data_entries = -(-size // nvs_const.entry_size)
+    if item_type == 'string':
+        if data_entries + 1 > ENTRIES_PER_PAGE:
+            raise ValueError(f'Strings take up to {(ENTRIES_PER_PAGE - 1) * nvs_const.entry_size} B, not {size} B')
+        return sum(capacity // (data_entries + 1) for capacity in capacities)
+
+    writes = 0
+    page = 0
+    free = capacities[0] if capacities else 0
+    while True:
+        remaining = data_entries
+        while True:
+            if free < (2 if remaining else 1):  # Chunk header and a data entry, empty blobs have a single empty chunk
+                page += 1
+                if page >= len(capacities):
+                    return writes
+                free = capacities[page]
+                continue
+            chunk = min(remaining, free - 1)
+            free -= chunk + 1
+            remaining -= chunk
+            if not remaining:
+                break
+        if free < 1:  # Blob index
+            page += 1
+            if page >= len(capacities):
+                return writes
+            free = capacities[page]
+        free -= 1
+        writes += 1
+
+
+def analyze(
+    nvs_partition: NVS_Partition, write_size: int = nvs_const.entry_size, write_type: str = 'string'
+) -> NVS_GC_Report:
+    """Analyzes free space and garbage collection pressure of the partition in a single pass over
+    page headers and entry state bitmaps (entries are not decoded)
+    """
+    image = memoryview(nvs_partition.raw_data)
+    pages: List[NVS_Page_Usage] = []
+    active_page: Optional[int] = None
+    for page_no in range(len(image) // nvs_const.page_size):
+        address = page_no * nvs_const.page_size
+        row = decode_page_row(image[address: address + nvs_const.page_size])
+        status = nvs_const.page_status.get(row.status, 'Invalid')
+        states = row.states
+        written = states.count(STATE_WRITTEN)
+        erased = states.count(STATE_ERASED)
+        free = states.count(STATE_EMPTY)
+        invalid = len(states) - written - erased - free
+        if status == 'Empty':
+            pages.append(NVS_Page_Usage(page_no, None, status, written, erased, free, invalid, ENTRIES_PER_PAGE, 0))
+            continue
+        writable = 0
+        if status == 'Active':
+            # Items are appended after the last used entry
+            last_used = max((i for i, state in enumerate(states) if state != STATE_EMPTY), default=-1)
+            writable = len(states) - last_used - 1
+            if active_page is None or row.page_index > pages[active_page].sequence:  # type: ignore
+                active_page = page_no
+        # Free entries of the active page are writable already
+        reclaimable = erased + invalid if status in ('Active', 'Full') else 0
+        pages.append(NVS_Page_Usage(
+            page_no, row.page_index, status, written, erased, free, invalid, writable, reclaimable
+        ))
+
+    # Only the active page and empty pages but the reserved one take new items
+    empty_pages = sum(page.status == 'Empty' for page in pages)
+    capacities = [pages[active_page].writable] if active_page is not None else []
+    capacities += [ENTRIES_PER_PAGE] * max(empty_pages - 1, 0)
+    for page in pages:
+        if page.page != active_page and page.status != 'Empty':
+            pages[page.page] = page._replace(writable=0)
+
+    # Page with most reclaimable entries goes first, the oldest one of equal pages
+    candidates = [page for page in pages if page.reclaimable > 0 and page.page != active_page]
+    candidates.sort(key=lambda page: (-page.reclaimable, page.sequence))
+    return NVS_GC_Report(
+        pages=pages,
+        active_page=active_page,
+        empty_pages=empty_pages,
+        writable_entries=sum(capacities),
+        reclaimable_entries=sum(page.reclaimable for page in pages),
+        write_size=write_size,
+        write_type=write_type,
+        writes_before_gc=writes_before_gc(capacities, write_size, write_type),
+        gc_order=[page.page for page in candidates],
+    )
@@ -4,9 +4,10 @@
 import binascii
 import json
 import sys
-from typing import Any, Dict, List, Union
+from typing import Any, Dict, Iterable, List, Optional, TextIO, Union
 
-from nvs_parser import NVS_Entry, NVS_Partition, nvs_const
+import nvs_gc
+from nvs_parser import NVS_Entry, NVS_Item, NVS_Partition, entry_value, nvs_const, scan_namespaces
 
 
 class NVS_Logger:
@@ -20,20 +21,22 @@ class NVS_Logger:
         'clear': '\033[0m',
     }
 
-    def __init__(self, *, color: str = 'auto', out_format: str = 'text'):
-        self.color = color == 'always' or (color == 'auto' and sys.stdout.isatty())
+    def __init__(self, *, color: str = 'auto', out_format: str = 'text', file: Optional[TextIO] = None):
+        # `file` redirects info() output of this logger (stdout by default)
+        self.file = file
+        self.color = color == 'always' or (color == 'auto' and (file or sys.stdout).isatty())
         self.output_format = out_format
 
     def set_color(self, color: str) -> None:
-        self.color = color == 'always' or (color == 'auto' and sys.stdout.isatty())
+        self.color = color == 'always' or (color == 'auto' and (self.file or sys.stdout).isatty())
 
     def set_format(self, out_format: str) -> None:
         self.output_format = out_format
 
     def info(self, *args, **kwargs) -> None:  # type: ignore
         kwargs['file'] = kwargs.get(
-            'file', sys.stdout
-        )  # Set default output to be stdout, but can be overwritten
+            'file', self.file or sys.stdout
+        )  # Set default output to be stdout (or file of the logger), but can be overwritten
         print(*args, **kwargs)
 
     def error(self, *args, **kwargs) -> None:  # type: ignore
@@ -126,17 +129,51 @@ def storage_stats(nvs_partition: NVS_Partition) -> None:
     nvs_log.info()
 
 
+def gc_stats(nvs_partition: NVS_Partition, write_size: int = nvs_const.entry_size, write_type: str = 'string') -> None:
+    report = nvs_gc.analyze(nvs_partition, write_size, write_type)
+
+    nvs_log.info(nvs_log.bold('Page\tSequence\tStatus\t\tWritten\tErased\tEmpty\tWritable\tReclaimable'))
+    for page in report.pages:
+        sequence = '-' if page.sequence is None else f'{page.sequence}'
+        status_tab = '\t' * (2 - len(page.status) // 8)
+        nvs_log.info(
+            f'{page.page:3d}\t{sequence: >8}\t{page.status}{status_tab}{page.written: 7d}\t'
+            + f'{page.erased: 6d}\t{page.free: 5d}\t{page.writable: 8d}\t{page.reclaimable: 11d}'
+        )
+    nvs_log.info()
+
+    nvs_log.info(nvs_log.bold('Garbage collection'))
+    nvs_log.info(f'  Active page:        {"none" if report.active_page is None else report.active_page: >5}')
+    nvs_log.info(f'  Empty pages:        {report.empty_pages: 5d} (one is reserved for garbage collection)')
+    nvs_log.info(f'  Writable entries:   {report.writable_entries: 5d}')
+    nvs_log.info(f'  Reclaimable:        {report.reclaimable_entries: 5d} entries')
+    writes = f'  Writes before GC:   {report.writes_before_gc: 5d} ({report.write_type} values of {report.write_size} B)'
+    nvs_log.info(nvs_log.red(writes) if report.writes_before_gc == 0 else writes)
+    nvs_log.info(f'  GC order (pages):   {", ".join(str(page) for page in report.gc_order) or "none"}')
+    nvs_log.info()
+
+
+def print_gc_json(
+    nvs_partition: NVS_Partition, write_size: int = nvs_const.entry_size, write_type: str = 'string', end: str = '\n'
+) -> None:
+    report = {'name': nvs_partition.name, **nvs_gc.analyze(nvs_partition, write_size, write_type).toJSON()}
+    print(json.dumps(report, indent=2), end=end)
+
+
 def dump_everything(nvs_partition: NVS_Partition, written_only: bool = False) -> None:
     for page in nvs_partition.pages:
+        # Verify CRC32 of the page header and of all non-free entries at once
+        crc_mismatches = {
+            (m.entry, m.kind) for m in page.verify_crcs(states=None)
+        }
+
         # Print page header
         if page.is_empty:
             nvs_log.info(
                 nvs_log.bold(f'Page Empty, Page address: 0x{page.start_address:x}')
             )
         else:
-            if (
-                page.header['crc']['original'] == page.header['crc']['computed']
-            ):  # Color CRC32
+            if (None, 'page') not in crc_mismatches:  # Color CRC32
                 crc = nvs_log.green(f'{page.header["crc"]["original"]: >8x}')
             else:
                 crc = nvs_log.red(f'{page.header["crc"]["original"]: >8x}')
@@ -191,27 +228,25 @@ def dump_everything(nvs_partition: NVS_Partition, written_only: bool = False) ->
                 status = nvs_log.red(f'{status: <7}')
 
             crc = ''
-            if (
-                entry.metadata['crc']['original'] == entry.metadata['crc']['computed']
-            ):  # Color CRC32
-                crc = nvs_log.green(f'{entry.metadata["crc"]["original"]: >8x}')
+            if (entry.index, 'entry') not in crc_mismatches:  # Color CRC32
+                crc = nvs_log.green(f'{entry.crc_original: >8x}')
             else:
-                crc = nvs_log.red(f'{entry.metadata["crc"]["original"]: >8x}')
+                crc = nvs_log.red(f'{entry.crc_original: >8x}')
 
             nvs_log.info(
                 nvs_log.bold(f' {entry.index:03d}.')
                 + ' '
                 + status
-                + f', Namespace Index: {entry.metadata["namespace"]:03d}'
-                + f', Type: {entry.metadata["type"]:<10}'
-                + f', Span: {entry.metadata["span"]:03d}'
-                + f', Chunk Index: {entry.metadata["chunk_index"]:03d}'
+                + f', Namespace Index: {entry.namespace:03d}'
+                + f', Type: {entry.type_name:<10}'
+                + f', Span: {entry.span:03d}'
+                + f', Chunk Index: {entry.chunk_index:03d}'
                 + f', CRC32: {crc}'
                 + f' | {entry.key} : ',
                 end='',
             )
 
-            if entry.metadata['type'] not in [
+            if entry.type_name not in [
                 'string',
                 'blob_data',
                 'blob_index',
@@ -222,7 +257,7 @@ def dump_everything(nvs_partition: NVS_Partition, written_only: bool = False) ->
                 else:
                     nvs_log.info(entry.data)  # None
             else:
-                if entry.metadata['type'] == 'blob_index':
+                if entry.type_name == 'blob_index':
                     nvs_log.info(
                         f'Size={entry.data["size"]}'
                         + f', ChunkCount={entry.data["chunk_count"]}'
@@ -230,18 +265,18 @@ def dump_everything(nvs_partition: NVS_Partition, written_only: bool = False) ->
                     )
                 else:
                     if (
-                        entry.metadata['crc']['data_original']
-                        == entry.metadata['crc']['data_computed']
+                        entry.crc_data_original
+                        == entry.crc_data_computed
                     ):  # Color CRC32
                         crc = nvs_log.green(
-                            f'{entry.metadata["crc"]["data_original"]:x}'
+                            f'{entry.crc_data_original:x}'
                         )
                     else:
-                        crc = nvs_log.red(f'{entry.metadata["crc"]["data_original"]:x}')
+                        crc = nvs_log.red(f'{entry.crc_data_original:x}')
                     nvs_log.info(f'Size={entry.data["size"]}, CRC32={crc}')
 
             # Dump all children entries
-            if entry.metadata['span'] != 1:
+            if entry.span != 1:
                 for i, data in enumerate(entry.children):
                     nvs_log.info(
                         f'{"": >6}0x{(i*nvs_const.entry_size):03x}  {data.dump_raw()}'
@@ -265,11 +300,7 @@ def dump_written_entries(nvs_partition: NVS_Partition) -> None:
 
 def list_namespaces(nvs_partition: NVS_Partition) -> None:
     # Gather namespaces
-    ns = {}
-    for page in nvs_partition.pages:
-        for entry in page.entries:
-            if entry.state == 'Written' and entry.metadata['namespace'] == 0:
-                ns[entry.data['value']] = entry.key
+    ns = nvs_partition.namespaces()
 
     # Print found namespaces
     nvs_log.info(nvs_log.bold(f'Index : Namespace'))
@@ -278,15 +309,13 @@ def list_namespaces(nvs_partition: NVS_Partition) -> None:
 
 
 def dump_key_value_pairs(nvs_partition: NVS_Partition) -> None:
-    # Get namespace list
-    ns = {}
-    for page in nvs_partition.pages:
-        for entry in page.entries:
-            if entry.state == 'Written' and entry.metadata['namespace'] == 0:
-                ns[entry.data['value']] = entry.key
+    # Live view of the partition (pages in order of their sequence numbers, superseded entries left out)
+    index = nvs_partition.index()
+    ns = index.namespaces
 
     # Print key-value pairs
-    for page in nvs_partition.pages:
+    for page_no in index.page_order:
+        page = nvs_partition.pages[page_no]
         # Print page header
         if page.is_empty:
             nvs_log.info(nvs_log.bold('Page Empty'))
@@ -301,37 +330,34 @@ def dump_key_value_pairs(nvs_partition: NVS_Partition) -> None:
         # Print entries
         for entry in page.entries:
             if (
-                entry.state == 'Written' and entry.metadata['namespace'] != 0
-            ):  # Ignore non-written entries
+                entry.state == 'Written' and entry.namespace != 0 and index.is_live(entry)
+            ):  # Ignore non-written and superseded entries
                 chunk_index = ''
                 data = ''
-                if entry.metadata['type'] not in [
+                if entry.type_name not in [
                     'string',
                     'blob_data',
                     'blob_index',
                     'blob',
                 ]:  # Non-variable length entry
                     data = entry.data['value']
-                elif entry.metadata['type'] == 'blob_index':
+                elif entry.type_name == 'blob_index':
                     continue
                 else:  # Variable length entries
-                    tmp = b''
-                    for e in entry.children:  # Merge all children entries
-                        tmp += bytes(e.raw)
-                    tmp = tmp[: entry.data['size']]  # Discard padding
-                    if entry.metadata['type'] == 'blob_data':
-                        if entry.metadata['chunk_index'] >= 128:  # Get real chunk index
-                            chunk_index = f'[{entry.metadata["chunk_index"] - 128}]'
+                    tmp = entry.value_view().tobytes()  # Merged children entries without padding
+                    if entry.type_name == 'blob_data':
+                        if entry.chunk_index >= 128:  # Get real chunk index
+                            chunk_index = f'[{entry.chunk_index - 128}]'
                         else:
-                            chunk_index = f'[{entry.metadata["chunk_index"]}]'
+                            chunk_index = f'[{entry.chunk_index}]'
                     data = str(tmp)
 
-                if entry.metadata['namespace'] not in ns:
+                if entry.namespace not in ns:
                     continue
                 else:
                     nvs_log.info(
                         ' '
-                        + nvs_log.cyan(ns[entry.metadata['namespace']])
+                        + nvs_log.cyan(ns[entry.namespace])
                         + ':'
                         + nvs_log.yellow(entry.key)
                         + f'{chunk_index} = {data}'
@@ -340,53 +366,30 @@ def dump_key_value_pairs(nvs_partition: NVS_Partition) -> None:
 
 
 def dump_written_blobs(nvs_partition: NVS_Partition) -> None:
-    blobs: Dict = {}
     strings: List[NVS_Entry] = []
     legacy_blobs: List[NVS_Entry] = []
-    ns = {}
-    empty_entry = NVS_Entry(-1, bytearray(32), 'Erased')
+    ns = nvs_partition.namespaces()
+    # Blob chunks are already linked to their blob indexes by the partition index
+    index = nvs_partition.index()
 
-    # Gather namespaces, blob indexes and legacy blobs
+    # Gather strings and legacy blobs
     for page in nvs_partition.pages:
         for entry in page.entries:
             if entry.state == 'Written':
-                if entry.metadata['type'] == 'blob_index':
-                    blobs[f'{entry.metadata["namespace"]:03d}{entry.key}'] = [entry] + [
-                        empty_entry
-                    ] * entry.data['chunk_count']
-                elif entry.metadata['type'] == 'blob':
+                if entry.type_name == 'blob':
                     legacy_blobs.append(entry)
-                elif entry.metadata['type'] == 'string':
+                elif entry.type_name == 'string':
                     strings.append(entry)
-                elif entry.metadata['namespace'] == 0:
-                    ns[entry.data['value']] = entry.key
 
     # Dump blobs
-    for key in blobs:
-        for page in nvs_partition.pages:
-            for entry in page.entries:
-                # Gather all blob chunks
-                if (
-                    entry.state == 'Written'
-                    and entry.metadata['type'] != 'blob_index'
-                    and entry.metadata['namespace']
-                    == blobs[key][0].metadata['namespace']
-                    and entry.key == blobs[key][0].key
-                ):
-                    blobs[key][
-                        1
-                        + entry.metadata['chunk_index']
-                        - blobs[key][0].data['chunk_start']
-                    ] = entry
-
-        blob_index = blobs[key][0]
-        blob_chunks = blobs[key][1:]
+    for blob_key, blob_index in index.blob_indexes.items():
+        blob_chunks = index.blob_chunks[blob_key]
 
         # Print blob info
         nvs_log.info(
             nvs_log.cyan(
                 ns.get(
-                    blob_index.metadata['namespace'], blob_index.metadata['namespace']
+                    blob_index.namespace, blob_index.namespace
                 )
             )
             + ':'
@@ -397,15 +400,15 @@ def dump_written_blobs(nvs_partition: NVS_Partition) -> None:
         )
 
         # Print blob data
-        raw_entries = []
+        raw_entries: List[Optional[NVS_Entry]] = []
         for kid in blob_chunks:  # Gather all chunk entries
-            if kid is empty_entry:
-                raw_entries += [empty_entry]
+            if kid is None:
+                raw_entries += [None]
             else:
                 raw_entries += kid.children
 
         for i, entry in enumerate(raw_entries):
-            if entry is empty_entry:
+            if entry is None:
                 nvs_log.info(nvs_log.yellow(f'  {"":->63} Missing data {"":-<64}'))
             else:
                 nvs_log.info(
@@ -417,7 +420,7 @@ def dump_written_blobs(nvs_partition: NVS_Partition) -> None:
     for string in strings:
         nvs_log.info(
             nvs_log.cyan(
-                ns.get(string.metadata['namespace'], string.metadata['namespace'])
+                ns.get(string.namespace, string.namespace)
             )
             + ':'
             + nvs_log.yellow(string.key)
@@ -432,7 +435,7 @@ def dump_written_blobs(nvs_partition: NVS_Partition) -> None:
     # Dump legacy blobs
     for blob in legacy_blobs:
         nvs_log.info(
-            nvs_log.cyan(ns.get(blob.metadata['namespace'], blob.metadata['namespace']))
+            nvs_log.cyan(ns.get(blob.namespace, blob.namespace))
             + ':'
             + nvs_log.yellow(blob.key)
             + ' - '
@@ -444,15 +447,140 @@ def dump_written_blobs(nvs_partition: NVS_Partition) -> None:
         nvs_log.info()
 
 
-def print_json(nvs: NVS_Partition) -> None:
-    class NVSEncoder(json.JSONEncoder):
-        def default(self, obj: Any) -> Union[Any, Dict[str, Any], str]:
-            if hasattr(obj, 'toJSON'):
-                return obj.toJSON()
-            if isinstance(obj, bytearray):
-                return binascii.b2a_base64(obj, newline=False).decode(
-                    'ascii'
-                )  # Binary to Base64 ASCII representation
-            return json.JSONEncoder.default(self, obj)
+def dump_entry_stream(items: Iterable[NVS_Item]) -> None:
+    """Prints entries as they are decoded (see `nvs_parser.iter_entries()`)
+
+    Namespaces are resolved to names only if their definition was already seen
+    """
+    ns: Dict[int, str] = {}
+    for item in items:
+        if item.state == 'Written' and item.namespace == 0:
+            ns[item.value] = item.key
+
+        status = item.state
+        if status == 'Written':
+            status = nvs_log.green(f'{status: <7}')
+        elif status == 'Erased':
+            status = nvs_log.red(f'{status: <7}')
+
+        if item.type == 'blob_index' and item.value is not None:
+            value = (
+                f'Size={item.value[0]}'
+                + f', ChunkCount={item.value[1]}'
+                + f', ChunkStart={item.value[2]}'
+            )
+        else:
+            value = str(item.value)
+        nvs_log.info(
+            nvs_log.bold(f'{item.page:04d}.{item.entry:03d}')
+            + ' '
+            + status
+            + ' '
+            + nvs_log.cyan(str(ns.get(item.namespace, item.namespace)))
+            + ':'
+            + nvs_log.yellow(str(item.key))
+            + f' ({item.type}) = {value}'
+        )
+
 
-    print(json.dumps(nvs.toJSON(), cls=NVSEncoder, indent=2))
+class NVSEncoder(json.JSONEncoder):
+    def default(self, obj: Any) -> Union[Any, Dict[str, Any], str]:
+        if hasattr(obj, 'toJSON'):
+            return obj.toJSON()
+        if isinstance(obj, bytearray):
+            return binascii.b2a_base64(obj, newline=False).decode(
+                'ascii'
+            )  # Binary to Base64 ASCII representation
+        return json.JSONEncoder.default(self, obj)
+
+
+def print_json(nvs: NVS_Partition, file: Optional[TextIO] = None, compact: bool = False, end: str = '\n') -> None:
+    """Writes the partition as JSON page by page, only the page being written is held in memory
+    (pages not decoded yet are not kept, see `NVS_Page_List.transient()`)
+
+    `compact` output has no indentation and leaves out empty entries, `end` is written after the document
+    """
+    out = file or sys.stdout
+    if compact:
+        encoder = NVSEncoder(separators=(',', ':'))
+        out.write(f'{{"name":{json.dumps(nvs.name)},"pages":[')
+    else:
+        encoder = NVSEncoder(indent=2)
+        out.write(f'{{\n  "name": {json.dumps(nvs.name)},\n  "pages": [')
+
+    for page_no in range(len(nvs.pages)):
+        page = nvs.pages.transient(page_no)
+        if page_no:
+            out.write(',')
+        if compact:
+            page_json = page.toJSON()
+            page_json['entries'] = [entry for entry in page_json['entries'] if not entry.is_empty]
+            out.write(encoder.encode(page_json))
+        else:
+            # Nested two levels deep, strings never hold a newline
+            out.write('\n    ' + encoder.encode(page).replace('\n', '\n    '))
+
+    if compact:
+        out.write(']}' + end)
+    else:
+        out.write(('\n  ]\n}' if len(nvs.pages) else ']\n}') + end)
+
+
+def _ndjson_value(entry: NVS_Entry) -> Any:
+    """Returns JSON representable value of the entry: number, text of strings, hex of blob data
+    and size with chunk range of blob indexes
+    """
+    data = entry.data
+    if data is None:  # Undecodable entry (e.g. non-ASCII key)
+        return None
+    if entry.type_name == 'blob_index':
+        return {'size': data['size'], 'chunk_count': data['chunk_count'], 'chunk_start': data['chunk_start']}
+    value = entry_value(entry)
+    if value is None:
+        return None
+    if entry.type_name == 'string':
+        return value.decode('utf-8', errors='backslashreplace').rstrip('\x00')
+    if isinstance(value, bytes):
+        return value.hex()
+    return value
+
+
+def _ndjson_crc_ok(entry: NVS_Entry) -> bool:
+    if entry.crc_original != entry.crc_computed:
+        return False
+    return entry.span <= 1 or entry.crc_data_original == entry.crc_data_computed
+
+
+# Field name -> field getter (entry, page number, namespace map, partition)
+NDJSON_FIELDS = {
+    'partition': lambda entry, page_no, namespaces, nvs: nvs.name,
+    'page': lambda entry, page_no, namespaces, nvs: page_no,
+    'index': lambda entry, page_no, namespaces, nvs: entry.index,
+    'ns': lambda entry, page_no, namespaces, nvs: namespaces.get(entry.namespace),
+    'ns_index': lambda entry, page_no, namespaces, nvs: entry.namespace,
+    'key': lambda entry, page_no, namespaces, nvs: entry.key,
+    'type': lambda entry, page_no, namespaces, nvs: entry.type_name,
+    'span': lambda entry, page_no, namespaces, nvs: entry.span,
+    'chunk_index': lambda entry, page_no, namespaces, nvs: entry.chunk_index,
+    'value': lambda entry, page_no, namespaces, nvs: _ndjson_value(entry),
+    'crc_ok': lambda entry, page_no, namespaces, nvs: _ndjson_crc_ok(entry),
+}
+NDJSON_DEFAULT_FIELDS = ['page', 'index', 'ns', 'key', 'type', 'value', 'crc_ok']
+
+
+def print_ndjson(nvs: NVS_Partition, fields: Iterable[str] = NDJSON_DEFAULT_FIELDS, file: Optional[TextIO] = None) -> None:
+    """Writes every written entry as a JSON object on its own line, page by page as the pages are decoded
+
+    Only the selected `fields` (see `NDJSON_FIELDS`) are computed, namespace names are taken
+    from entry headers of namespace definitions up front (see `nvs_parser.scan_namespaces()`) if needed
+    """
+    out = file or sys.stdout
+    getters = [(field, NDJSON_FIELDS[field]) for field in fields]
+    namespaces = scan_namespaces(nvs.raw_data) if 'ns' in fields else {}
+    encoder = json.JSONEncoder()
+    for page_no in range(len(nvs.pages)):
+        for entry in nvs.pages.transient(page_no).entries:
+            if entry.state != 'Written' or entry.is_empty:
+                continue
+            out.write(encoder.encode({field: getter(entry, page_no, namespaces, nvs) for field, getter in getters}))
+            out.write('\n')
@@ -1,12 +1,36 @@
 #!/usr/bin/env python3
 # SPDX-FileCopyrightText: 2022-2024 Espressif Systems (Shanghai) CO LTD
 # SPDX-License-Identifier: Apache-2.0
+import hashlib
+import mmap
+import os
+import struct
+import weakref
+from collections.abc import Mapping
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from multiprocessing import shared_memory
 from typing import Any
+from typing import BinaryIO
+from typing import Callable
+from typing import Container
 from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
+from typing import NamedTuple
 from typing import Optional
+from typing import Set
+from typing import Tuple
+from typing import Union
 from zlib import crc32
 
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, it only enables the 'numpy' parser backend
+    np = None  # type: ignore
+
 
 # Constants
 class NVS_Constants:
@@ -57,70 +81,817 @@ class NotAlignedError(ValueError):
     pass
 
 
+# ESP-IDF partition table, 32 B entries: magic, type, subtype, offset, size, label, flags
+PARTITION_TABLE_OFFSET = 0x8000
+PARTITION_TABLE_SIZE = 0xC00
+PARTITION_TYPE_DATA = 0x01
+PARTITION_SUBTYPE_NVS = 0x02
+_PARTITION_ENTRY = struct.Struct('<2sBBII16sI')
+_PARTITION_MAGIC = b'\xaa\x50'
+_PARTITION_MD5_MAGIC = b'\xeb\xeb'
+
+
+class NVS_Partition_Info(NamedTuple):
+    """Entry of the ESP-IDF partition table
+    """
+    name: str
+    type: int
+    subtype: int
+    offset: int
+    size: int
+    flags: int
+
+    @property
+    def is_nvs(self) -> bool:
+        return self.type == PARTITION_TYPE_DATA and self.subtype == PARTITION_SUBTYPE_NVS
+
+
+def read_partition_table(path: str, table_offset: int = PARTITION_TABLE_OFFSET) -> List[NVS_Partition_Info]:
+    """Reads the partition table of a flash image (only the table is read, not the partitions)
+    """
+    with open(path, 'rb') as f:
+        f.seek(table_offset)
+        table = f.read(PARTITION_TABLE_SIZE)
+
+    partitions = []
+    for entry_offset in range(0, len(table) - _PARTITION_ENTRY.size + 1, _PARTITION_ENTRY.size):
+        magic, p_type, subtype, offset, size, label, flags = _PARTITION_ENTRY.unpack_from(table, entry_offset)
+        if magic == _PARTITION_MD5_MAGIC:  # Checksum of the table
+            continue
+        if magic != _PARTITION_MAGIC:  # End of the table (erased flash)
+            break
+        name = label.rstrip(b'\x00').decode('ascii', errors='replace')
+        partitions.append(NVS_Partition_Info(name, p_type, subtype, offset, size, flags))
+    if not partitions:
+        raise ValueError(f'No partition table found at 0x{table_offset:x} in {path}')
+    return partitions
+
+
+def find_nvs_partitions(
+    path: str, name: Optional[str] = None, table_offset: int = PARTITION_TABLE_OFFSET
+) -> List[NVS_Partition_Info]:
+    """Returns all data/nvs partitions of a flash image (or only the one called `name`)
+    """
+    partitions = [info for info in read_partition_table(path, table_offset) if info.is_nvs]
+    if name is not None:
+        found = [info for info in partitions if info.name == name]
+        if not found:
+            raise ValueError(
+                f'No NVS partition {name!r} in {path} (NVS partitions: {", ".join(info.name for info in partitions)})'
+            )
+        return found
+    return partitions
+
+
 class NVS_Partition:
-    def __init__(self, name: str, raw_data: bytearray):
+    def __init__(
+        self,
+        name: str,
+        raw_data: Union[bytes, bytearray, memoryview],
+        backend: str = 'python',
+        rows: Optional[Sequence[Optional['NVS_Page_Row']]] = None,
+        namespaces: Optional[Dict[int, str]] = None,
+        workers: int = 1,
+    ):
+        """`rows` and `namespaces` optionally hold an already decoded form of the same image
+        (see `rows()` and `nvs_cache`), pages are then built from the rows instead of decoding their headers.
+        With `workers` other than 1 the rows are decoded up front in a pool of processes (see `decode_rows()`)
+        """
         if len(raw_data) % nvs_const.page_size != 0:
             raise NotAlignedError(
                 f'Given partition data is not aligned to page size ({len(raw_data)} % {nvs_const.page_size} = {len(raw_data)%nvs_const.page_size})'
             )
 
+        if workers != 1 and rows is None:
+            rows = decode_rows(raw_data, workers)
+
         self.name = name
         self.raw_data = raw_data
-        # Divide partition into pages
-        self.pages = []
-        for i in range(0, len(raw_data), nvs_const.page_size):
-            self.pages.append(NVS_Page(raw_data[i: i + nvs_const.page_size], i))
+        # (path, offset, length) of the file region the partition was mapped from, see from_file() and reload()
+        self.source: Optional[Tuple[str, int, int]] = None
+        # With the 'numpy' backend all page and entry headers are decoded at once into a columnar table
+        self.table: Optional[NVS_Table] = None
+        if backend == 'numpy':
+            self.table = NVS_Table(raw_data)
+        elif backend != 'python':
+            raise ValueError(f'Unknown parser backend {backend!r} (expected \'python\' or \'numpy\')')
+        # Pages are windows into a single view of the image, no page is copied
+        # and no page is decoded until it is accessed
+        self.pages = NVS_Page_List(memoryview(raw_data), self.table, rows)
+        # Lookup index, built on first lookup (see index())
+        self._index: Optional[NVS_Index] = None
+        self._namespaces = namespaces
+
+    @classmethod
+    def from_file(
+        cls,
+        path: str,
+        offset: int = 0,
+        length: Optional[int] = None,
+        backend: str = 'python',
+        workers: int = 1,
+    ) -> 'NVS_Partition':
+        """Parses a partition directly over a read-only memory mapping of the file
+
+        `offset` and `length` select a region of a larger file (e.g. a full flash dump),
+        by default the whole file is used. With `workers` other than 1 every worker process maps the file
+        on its own, see `decode_rows()`
+        """
+        with open(path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            if length is None:
+                length = file_size - offset
+            if offset < 0 or length < 0 or offset + length > file_size:
+                raise ValueError(
+                    f'Region 0x{offset:x}+0x{length:x} does not fit into {path} (size 0x{file_size:x})'
+                )
+            if length == 0:  # Empty files cannot be mapped
+                data = memoryview(b'')
+            else:
+                # Mapping offset has to be aligned to the allocation granularity
+                map_offset = offset - offset % mmap.ALLOCATIONGRANULARITY
+                mapping = mmap.mmap(
+                    f.fileno(),
+                    offset - map_offset + length,
+                    access=mmap.ACCESS_READ,
+                    offset=map_offset,
+                )
+                # The mapping stays open for as long as any view into it is alive
+                data = memoryview(mapping)[offset - map_offset:]
+        rows = None
+        if workers != 1 and length % nvs_const.page_size == 0:  # Unaligned regions are rejected by the constructor
+            rows = decode_rows(path, workers, offset, length)
+        partition = cls(os.path.basename(path), data, backend, rows=rows)
+        partition.source = (path, offset, length)
+        return partition
+
+    @classmethod
+    def from_flash_image(
+        cls,
+        path: str,
+        name: Optional[str] = None,
+        table_offset: int = PARTITION_TABLE_OFFSET,
+        backend: str = 'python',
+        workers: int = 1,
+    ) -> List['NVS_Partition']:
+        """Parses every NVS partition (or only the one called `name`) of a full flash image
+
+        Partitions are located by the partition table at `table_offset`, each one is parsed over
+        a memory mapping of its own region of the image (see `from_file()`) and named by its label
+        """
+        partitions = []
+        for info in find_nvs_partitions(path, name, table_offset):
+            partition = cls.from_file(path, info.offset, info.size, backend, workers)
+            partition.name = info.name
+            partitions.append(partition)
+        return partitions
+
+    def close(self) -> None:
+        """Drops all pages and the index and releases the image, a memory mapping of the file (see `from_file()`)
+        is closed as well unless entries or values taken from the partition still view into it,
+        it is then closed once the last of them is gone
+        """
+        raw_data = self.raw_data
+        self.raw_data = b''
+        self.table = None
+        self.pages = NVS_Page_List(memoryview(self.raw_data), None)
+        self._index = None
+        self._namespaces = None
+        if isinstance(raw_data, memoryview) and isinstance(raw_data.obj, mmap.mmap):
+            mapping = raw_data.obj
+            try:
+                raw_data.release()
+                mapping.close()
+            except BufferError:  # Still viewed elsewhere
+                pass
+
+    def __enter__(self) -> 'NVS_Partition':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def update(self, raw_data: Union[bytes, bytearray, memoryview]) -> List[int]:
+        """Replaces the image by `raw_data` (e.g. a refreshed dump) and re-decodes only the pages which changed
+
+        Every decoded page is compared by its digest taken when it was decoded, unchanged pages (and their entries)
+        are kept and moved over to the new image, changed ones are dropped and decoded again on their next access.
+        The index is updated page by page as well. Returns numbers of the dropped pages
+        (pages added or removed by a change of the image size included).
+        """
+        if len(raw_data) % nvs_const.page_size != 0:
+            raise NotAlignedError(
+                f'Given partition data is not aligned to page size ({len(raw_data)} % {nvs_const.page_size} = {len(raw_data)%nvs_const.page_size})'
+            )
+        self.raw_data = raw_data
+        if self.table is not None:
+            self.table = NVS_Table(raw_data)
+        changed = self.pages.update(memoryview(raw_data), self.table)
+        self._namespaces = None
+        if self._index is not None:
+            self._index.update(self.pages, changed)
+        return changed
+
+    def reload(self) -> List[int]:
+        """Maps the file region the partition was opened from (see `from_file()`) again and updates the partition
+        with its current content, see `update()`
+        """
+        if self.source is None:
+            raise ValueError(f'Partition {self.name} was not opened from a file')
+        path, offset, length = self.source
+        return self.update(NVS_Partition.from_file(path, offset, length).raw_data)
+
+    def rows(self) -> List[Optional['NVS_Page_Row']]:
+        """Returns fully decoded rows of all pages (decodes every page), see `NVS_Page.row()`,
+        erased pages are None as they are never decoded anyway
+        """
+        return [None if page.entries is _EMPTY_PAGE_ENTRIES else page.row() for page in self.pages]
+
+    def verify_crcs(
+        self, pages: Optional[Iterable[int]] = None, states: Optional[Container[str]] = ('Written',)
+    ) -> List['NVS_CRC_Mismatch']:
+        """Verifies CRC32 of the given pages (page numbers, all pages by default), see `NVS_Page.verify_crcs()`
+        """
+        mismatches: List[NVS_CRC_Mismatch] = []
+        for page_no in range(len(self.pages)) if pages is None else pages:
+            mismatches.extend(self.pages[page_no].verify_crcs(states))
+        return mismatches
+
+    def index(self) -> 'NVS_Index':
+        """Returns the (namespace, key) lookup index of the partition, it is built by a single pass on first use
+        """
+        if self._index is None:
+            self._index = NVS_Index(self.pages)
+        return self._index
+
+    def get(self, namespace: str, key: str) -> Optional['NVS_Entry']:
+        """Returns the written entry holding the value of `key` in `namespace` (blob index for multi-chunk blobs)
+        """
+        return self.index().entries.get((namespace, key))
+
+    def namespaces(self) -> Dict[int, str]:
+        """Returns namespace index -> namespace name map of all written namespaces
+        """
+        if self._namespaces is None:
+            self._namespaces = self.index().namespaces
+        return dict(self._namespaces)
+
+    def value(self, namespace: str, key: str) -> Any:
+        """Returns value of `key` in `namespace` (None if not found), a number for primitive types
+        and `NVS_Value` for strings and blobs, multi-chunk blobs are assembled from all their chunks
+        """
+        entry = self.get(namespace, key)
+        if entry is None:
+            return None
+        return self.index().value(entry)
+
+    def blob_chunks(self, namespace: str, key: str) -> List[Optional['NVS_Entry']]:
+        """Returns chunks of the blob `key` in `namespace` ordered by chunk index (None for missing chunks)
+        """
+        index = self.index()
+        return list(index.blob_chunks.get((index.namespace_indexes.get(namespace, -1), key), []))
 
     def toJSON(self) -> Dict[str, Any]:
-        return dict(name=self.name, pages=self.pages)
+        return dict(name=self.name, pages=list(self.pages))
+
+
+def decode_rows(
+    source: Union[str, bytes, bytearray, memoryview],
+    workers: int = 0,
+    offset: int = 0,
+    length: Optional[int] = None,
+) -> List[Optional['NVS_Page_Row']]:
+    """Decodes rows of all pages (see `NVS_Partition.rows()`) in a pool of `workers` processes (0 = one per CPU)
+
+    `source` is either a path of a partition file (`offset` and `length` as in `NVS_Partition.from_file()`),
+    which every worker maps on its own, or a buffer, which is copied once into shared memory.
+    Workers decode contiguous runs of pages and send back only their rows, entries are then created
+    (and blobs and namespaces indexed) in the calling process from the rows.
+    """
+    if isinstance(source, str):
+        if length is None:
+            length = os.path.getsize(source) - offset
+        size = length
+    else:
+        size = len(source)
+    if size % nvs_const.page_size != 0:
+        raise NotAlignedError(
+            f'Given partition data is not aligned to page size ({size} % {nvs_const.page_size} = {size%nvs_const.page_size})'
+        )
+    page_count = size // nvs_const.page_size
+    workers = workers or os.cpu_count() or 1
+    if page_count == 0:
+        return []
+
+    # A few shards per worker even out pages which take longer to decode
+    shard_size = -(-page_count // (workers * 4))
+    shards = [(start, min(start + shard_size, page_count)) for start in range(0, page_count, shard_size)]
+
+    shm = None
+    if isinstance(source, str):
+        shard_source = ('file', source, offset)
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        assert shm.buf is not None  # Only None once closed
+        shm.buf[:size] = source
+        shard_source = ('shm', shm.name, 0)
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as executor:
+            results = executor.map(_decode_rows_shard, [shard_source] * len(shards), *zip(*shards))
+            return [None if row is None else NVS_Page_Row(*row) for rows in results for row in rows]
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+
+def _decode_rows_shard(source: Tuple[str, str, int], start: int, stop: int) -> List[Optional[tuple]]:
+    kind, name, offset = source
+    begin = offset + start * nvs_const.page_size
+    length = (stop - start) * nvs_const.page_size
+    if kind == 'file':
+        return _shard_rows(NVS_Partition.from_file(name, begin, length).raw_data)
+    shm = shared_memory.SharedMemory(name=name)
+    assert shm.buf is not None  # Only None once closed
+    try:
+        return _shard_rows(shm.buf[begin: begin + length])
+    finally:
+        shm.close()
+
+
+def _shard_rows(data: Union[bytes, bytearray, memoryview]) -> List[Optional[tuple]]:
+    return [None if row is None else tuple(row) for row in NVS_Partition('shard', data).rows()]
+
+
+class _NVS_Index_Page(NamedTuple):
+    sequence: int  # Page sequence number (page index from its header)
+    namespaces: List[Tuple[int, 'NVS_Entry']]  # (namespace index, namespace entry)
+    items: List['NVS_Entry']  # Keyed entries except blob chunks
+    chunks: List['NVS_Entry']
+
+
+_EMPTY_INDEX_PAGE = _NVS_Index_Page(0xFFFFFFFF, [], [], [])
+
+
+class NVS_Index:
+    """Live view of a partition - the written entries the device firmware would see
+
+    Pages are taken in order of their sequence numbers (`page_index` in the page header, physical order
+    on ties, empty pages last) and an entry written later supersedes the earlier ones with the same key,
+    the older copies are collected in `superseded`.
+
+    `entries` maps (namespace name, key) to the entry holding the live value, `live` lists these entries
+    in the order they were written, `blob_indexes` maps (namespace index, key) to the live blob index entry
+    of every multi-chunk blob and `blob_chunks` to its chunks linked by chunk index - chunk start
+    (None if missing). Chunks which do not belong to any blob index are collected in `orphan_chunks`.
+    """
+    def __init__(self, pages: Iterable['NVS_Page']):
+        self.namespaces: Dict[int, str] = {}
+        self.namespace_indexes: Dict[str, int] = {}
+        self.entries: Dict[Tuple[str, str], NVS_Entry] = {}
+        self.live: List[NVS_Entry] = []
+        self.superseded: Set[NVS_Entry] = set()
+        self.blob_indexes: Dict[Tuple[int, str], NVS_Entry] = {}
+        self.blob_chunks: Dict[Tuple[int, str], List[Optional[NVS_Entry]]] = {}
+        self.orphan_chunks: List[NVS_Entry] = []
+        self.page_order: List[int] = []
+        self._live_chunks: Set[NVS_Entry] = set()
+
+        # Written entries of every page, the tables above are merged from them
+        self._page_entries: List[_NVS_Index_Page] = [self._scan(page) for page in pages]
+        self._merge()
+
+    def update(self, pages: Sequence['NVS_Page'], changed: Iterable[int]) -> None:
+        """Scans the `changed` pages again (numbers of pages in `pages`) and merges the tables,
+        other pages are not touched
+        """
+        del self._page_entries[len(pages):]
+        changed = set(changed)
+        changed.update(range(len(self._page_entries), len(pages)))
+        self._page_entries.extend([_EMPTY_INDEX_PAGE] * (len(pages) - len(self._page_entries)))
+        for page_no in changed:
+            if page_no < len(pages):
+                self._page_entries[page_no] = self._scan(pages[page_no])
+        self._merge()
+
+    def is_live(self, entry: 'NVS_Entry') -> bool:
+        """Returns True for the entry holding a live value and for chunks of live blobs
+        """
+        if entry.type_name == 'blob_data':
+            return entry in self._live_chunks
+        return self.entries.get((self.namespaces.get(entry.namespace), entry.key)) is entry  # type: ignore
+
+    def is_superseded(self, entry: 'NVS_Entry') -> bool:
+        return entry in self.superseded
+
+    @staticmethod
+    def _scan(page: 'NVS_Page') -> '_NVS_Index_Page':
+        namespaces: List[Tuple[int, NVS_Entry]] = []
+        items: List[NVS_Entry] = []
+        chunks: List[NVS_Entry] = []
+        for entry in page.entries:
+            if entry.state != 'Written' or entry.key is None:
+                continue
+            definition = namespace_definition(entry.namespace, entry.key, entry.item_type, entry._raw[24:32])
+            if definition is not None:
+                namespaces.append((definition[0], entry))
+            elif entry.type_name == 'blob_data':
+                chunks.append(entry)
+            else:
+                items.append(entry)
+        sequence = 0xFFFFFFFF if page.header['status'] == 'Empty' else page.header['page_index']
+        return _NVS_Index_Page(sequence, namespaces, items, chunks)
+
+    def _merge(self) -> None:
+        self.page_order = sorted(range(len(self._page_entries)), key=lambda i: self._page_entries[i].sequence)
+        self.superseded = set()
+
+        def supersede(table: Dict[Any, NVS_Entry], key: Any, entry: NVS_Entry) -> None:
+            old = table.get(key)
+            if old is not None:
+                self.superseded.add(old)
+            table[key] = entry
+
+        namespace_entries: Dict[int, NVS_Entry] = {}
+        by_index: Dict[Tuple[int, str], NVS_Entry] = {}
+        self.blob_indexes = {}
+        chunks: Dict[Tuple[int, str, int], NVS_Entry] = {}
+        for page_no in self.page_order:  # Later pages win
+            page_entries = self._page_entries[page_no]
+            for ns_index, entry in page_entries.namespaces:
+                supersede(namespace_entries, ns_index, entry)
+            for entry in page_entries.items:
+                supersede(by_index, (entry.namespace, entry.key), entry)  # type: ignore
+                if entry.type_name == 'blob_index':
+                    self.blob_indexes[(entry.namespace, entry.key)] = entry  # type: ignore
+            for entry in page_entries.chunks:
+                supersede(chunks, (entry.namespace, entry.key, entry.chunk_index), entry)  # type: ignore
+        self.namespaces = {ns_index: entry.key for ns_index, entry in namespace_entries.items()}  # type: ignore
+        self.namespace_indexes = {name: ns_index for ns_index, name in self.namespaces.items()}
+
+        self.entries = {}
+        for (ns_index, key), entry in by_index.items():
+            if ns_index in self.namespaces:
+                self.entries[(self.namespaces[ns_index], key)] = entry
+        live = set(self.entries.values())
+        self.live = [
+            entry for page_no in self.page_order for entry in self._page_entries[page_no].items if entry in live
+        ]
+
+        # Link blob chunks to their blob indexes
+        self.blob_chunks = {}
+        self.orphan_chunks = []
+        self._live_chunks = set()
+        for blob_key, blob_index in self.blob_indexes.items():
+            self.blob_chunks[blob_key] = [None] * blob_index.data['chunk_count']  # type: ignore
+        for chunk in chunks.values():
+            blob_key = (chunk.namespace, chunk.key)  # type: ignore
+            blob_index = self.blob_indexes.get(blob_key)  # type: ignore
+            if blob_index is not None:
+                position = chunk.chunk_index - blob_index.data['chunk_start']  # type: ignore
+                if 0 <= position < len(self.blob_chunks[blob_key]):  # type: ignore
+                    self.blob_chunks[blob_key][position] = chunk  # type: ignore
+                    if by_index.get(blob_key) is blob_index and chunk.namespace in self.namespaces:
+                        self._live_chunks.add(chunk)
+                    continue
+            self.orphan_chunks.append(chunk)
+
+    def value(self, entry: 'NVS_Entry') -> Any:
+        """Returns value of the entry, a number for primitive types and `NVS_Value` for strings and blobs
+        (blob indexes are assembled from all their chunks)
+        """
+        if entry.type_name == 'blob_index':
+            blob_chunks = self.blob_chunks.get((entry.namespace, entry.key), [])  # type: ignore
+            parts: List[memoryview] = []
+            for chunk in blob_chunks:
+                if chunk is not None:
+                    parts.extend(chunk.value_view().parts)
+            return NVS_Value(
+                parts, entry.data['size'], sum(chunk is None for chunk in blob_chunks)  # type: ignore
+            )
+        return entry_value(entry, copy=False)
+
+
+class NVS_Value:
+    """String or blob data joined from its data entries (and chunks) without copying them
+
+    `parts` are memoryview windows into the image, padding is cut off and the parts are trimmed
+    to the declared size, `missing` counts chunks which were not found
+    """
+    __slots__ = ('parts', 'missing')
+
+    def __init__(self, parts: Iterable[memoryview], size: Optional[int] = None, missing: int = 0):
+        self.parts: List[memoryview] = []
+        for part in parts:
+            if size is not None:
+                if size <= 0:
+                    break
+                part = part[:size]
+                size -= len(part)
+            self.parts.append(part)
+        self.missing = missing
+
+    def __len__(self) -> int:
+        return sum(len(part) for part in self.parts)
+
+    def __bytes__(self) -> bytes:
+        return self.tobytes()
+
+    def tobytes(self) -> bytes:
+        return b''.join(self.parts)
+
+
+class NVS_Page_List(Sequence):
+    """Read-only sequence of partition pages, every page is decoded on its first access and then cached
+    """
+    def __init__(
+        self,
+        buffer: memoryview,
+        table: Optional['NVS_Table'] = None,
+        rows: Optional[Sequence[Optional['NVS_Page_Row']]] = None,
+    ):
+        self._buffer = buffer
+        self._table = table
+        self._rows = rows
+        self._pages: List[Optional['NVS_Page']] = [None] * (len(buffer) // nvs_const.page_size)
+        # Digests of decoded pages, see update()
+        self._digests: List[Optional[bytes]] = [None] * len(self._pages)
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self._pages)))]
+        page = self._pages[index]
+        if page is None:
+            if index < 0:
+                index += len(self._pages)
+            page = self._decode(index)
+            self._pages[index] = page
+            address = index * nvs_const.page_size
+            self._digests[index] = page_digest(self._buffer[address: address + nvs_const.page_size])
+        return page
+
+    def transient(self, index: int) -> 'NVS_Page':
+        """Returns the page like indexing does, but a page which is not decoded yet is not kept after decoding,
+        so a single pass over a large partition runs in constant memory
+        """
+        page = self._pages[index]
+        if page is None:
+            page = self._decode(index % len(self._pages))
+        return page
+
+    def _decode(self, index: int) -> 'NVS_Page':
+        address = index * nvs_const.page_size
+        if self._rows is not None:
+            row = self._rows[index]
+        elif self._table is not None:
+            row = self._table.page_row(index)
+        else:
+            row = None
+        return NVS_Page(self._buffer[address: address + nvs_const.page_size], address, row)
+
+    def update(self, buffer: memoryview, table: Optional['NVS_Table'] = None) -> List[int]:
+        """Switches over to a new image, decoded pages with unchanged digest are kept (see `NVS_Page.rebind()`),
+        the others are dropped. Returns numbers of the dropped pages and of pages added or removed
+        """
+        page_count = len(buffer) // nvs_const.page_size
+        changed = list(range(page_count, len(self._pages))) + list(range(len(self._pages), page_count))
+        del self._pages[page_count:]
+        del self._digests[page_count:]
+        self._pages.extend([None] * (page_count - len(self._pages)))
+        self._digests.extend([None] * (page_count - len(self._digests)))
+        for index, page in enumerate(self._pages):
+            if page is None:
+                continue
+            address = index * nvs_const.page_size
+            page_data = buffer[address: address + nvs_const.page_size]
+            if page_digest(page_data) == self._digests[index]:
+                page.rebind(page_data)
+            else:
+                self._pages[index] = None
+                self._digests[index] = None
+                changed.append(index)
+        self._buffer = buffer
+        self._table = table
+        # Rows describe the previous image
+        self._rows = None
+        return sorted(changed)
+
+
+def page_digest(page_data: Union[bytes, memoryview]) -> bytes:
+    return hashlib.blake2b(page_data, digest_size=16).digest()
+
+
+class NVS_CRC(Mapping):
+    """Read-only view of the CRC32 fields of a page or an entry
+
+    Field `name` maps to the `crc_<name>` attribute of the owner, so computed CRCs
+    are only calculated when they are looked up
+    """
+    __slots__ = ('_owner', '_fields')
+
+    def __init__(self, owner: Any, fields: Tuple[str, ...]):
+        self._owner = owner
+        self._fields = fields
+
+    def __getitem__(self, field: str) -> int:
+        if field not in self._fields:
+            raise KeyError(field)
+        return getattr(self._owner, f'crc_{field}')  # type: ignore
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._fields)
+
+    def __len__(self) -> int:
+        return len(self._fields)
+
+    def toJSON(self) -> Dict[str, int]:
+        return dict(self)
+
+
+class NVS_CRC_Mismatch(NamedTuple):
+    page: int  # Page number (position in the partition)
+    entry: Optional[int]  # Entry index, None for page header CRC
+    kind: str  # 'page' (page header), 'entry' (entry header) or 'data' (string/blob data)
+    original: int
+    computed: int
+
+
+class NVS_Page_Row(NamedTuple):
+    """Decoded header fields of a single page
+
+    Entry columns (`namespace` ... `is_empty`) are indexed by entry index and are only present in fully
+    decoded rows (see `NVS_Page.row()` and `NVS_Table`), otherwise entries decode their headers themselves.
+    These rows also hold the start of the free entry run at the end of the page (`free_tail`, in entries
+    from page start)
+    """
+    status: int
+    page_index: int
+    version: int
+    crc: int
+    states: List[int]  # Raw 2-bit entry states
+    namespace: Optional[List[int]] = None
+    item_type: Optional[List[int]] = None
+    span: Optional[List[int]] = None
+    chunk_index: Optional[List[int]] = None
+    entry_crc: Optional[List[int]] = None
+    data_crc: Optional[List[int]] = None
+    key: Optional[List[Optional[str]]] = None
+    is_empty: Optional[List[bool]] = None
+    free_tail: Optional[int] = None
+
+
+_STATE_NAMES = tuple(nvs_const.entry_status.get(state, 'Invalid') for state in range(4))
+# Page header: status, page index, version, (reserved), CRC32
+_PAGE_HEADER = struct.Struct('<IIB19xI')
+# Entry state bitmap byte -> states of its 4 entries (2 bits per entry, LSB first)
+_STATE_LUT = tuple(tuple((c >> index) & 3 for index in range(0, 8, 2)) for c in range(256))
+
+
+def decode_page_row(page_data: memoryview) -> NVS_Page_Row:
+    """Decodes the page header and entry state bitmap of a single page in pure Python
+    """
+    status, page_index, version, crc = _PAGE_HEADER.unpack_from(page_data)
+    bitmap = page_data[nvs_const.entry_size: 2 * nvs_const.entry_size]
+    entry_states = list(chain.from_iterable(map(_STATE_LUT.__getitem__, bitmap)))
+    return NVS_Page_Row(
+        status=status,
+        page_index=page_index,
+        version=version,
+        crc=crc,
+        states=entry_states[:-2],  # Last 2 states are padding
+    )
+
+
+class NVS_Table:
+    """Columnar table of all page headers, entry states and entry header fields of a partition
+
+    The image is viewed as a (pages, 128, 32) uint8 array and every column is decoded for all pages
+    at once with a handful of vectorized NumPy operations. Columns are NumPy arrays indexed
+    by [page] (page headers) or [page, entry] (entries, 126 per page), `page_row()` hands
+    a single page over to `NVS_Page` as a fully decoded row, so its entries are built without
+    any decoding of their own. Requires NumPy.
+    """
+    def __init__(self, raw_data: Union[bytes, bytearray, memoryview]):
+        if np is None:
+            raise RuntimeError('The numpy parser backend requires NumPy to be installed')
+        entries_per_page = nvs_const.page_size // nvs_const.entry_size
+        words_per_entry = nvs_const.entry_size // 4
+
+        # Views into the image, nothing is copied here
+        image = np.frombuffer(raw_data, dtype=np.uint8).reshape(-1, entries_per_page, nvs_const.entry_size)
+        words = np.frombuffer(raw_data, dtype='<u4').reshape(-1, entries_per_page, words_per_entry)
+        quads = np.frombuffer(raw_data, dtype='<u8').reshape(-1, entries_per_page, words_per_entry // 2)
+
+        # Page headers
+        self.status = words[:, 0, 0]
+        self.page_index = words[:, 0, 1]
+        self.version = image[:, 0, 8]
+        self.crc = words[:, 0, 7]
+
+        # Entry state bitmap, 4 entries per byte, 2 bits per entry (LSB first), last 2 states are padding
+        bitmap = image[:, 1, :]
+        self.states = (
+            (bitmap[:, :, np.newaxis] >> np.array([0, 2, 4, 6], dtype=np.uint8)) & 3
+        ).reshape(len(image), -1)[:, : entries_per_page - 2]
+
+        # Entry headers
+        entries = image[:, 2:, :]
+        self.namespace = entries[:, :, 0]
+        self.item_type = entries[:, :, 1]
+        self.span = entries[:, :, 2]
+        self.chunk_index = entries[:, :, 3]
+        self.entry_crc = words[:, 2:, 1]
+        self.data_crc = words[:, 2:, 7]
+        self.is_empty = (quads[:, 2:, :] == 0xFFFFFFFFFFFFFFFF).all(axis=2)
+        # Keys are decoded page by page in page_row() as in key_decode(), only ASCII keys are valid
+        self.key = entries[:, :, 8:24].copy().view('S16')[:, :, 0]
+        self.ascii_key = ((quads[:, 2:, 1] | quads[:, 2:, 2]) & 0x8080808080808080) == 0
+
+        # Free entries at the end of every page start after the last non-empty entry
+        used = ~self.is_empty
+        self.free_tail = np.where(used.any(axis=1), entries_per_page - np.argmax(used[:, ::-1], axis=1), 2)
+
+    def __len__(self) -> int:
+        return len(self.status)
+
+    def page_row(self, page: int) -> NVS_Page_Row:
+        keys = np.where(self.ascii_key[page], self.key[page], b'').astype('U16').tolist()
+        for entry in np.flatnonzero(~self.ascii_key[page]).tolist():
+            keys[entry] = None
+        return NVS_Page_Row(
+            status=int(self.status[page]),
+            page_index=int(self.page_index[page]),
+            version=int(self.version[page]),
+            crc=int(self.crc[page]),
+            states=self.states[page].tolist(),
+            namespace=self.namespace[page].tolist(),
+            item_type=self.item_type[page].tolist(),
+            span=self.span[page].tolist(),
+            chunk_index=self.chunk_index[page].tolist(),
+            entry_crc=self.entry_crc[page].tolist(),
+            data_crc=self.data_crc[page].tolist(),
+            key=keys,
+            is_empty=self.is_empty[page].tolist(),
+            free_tail=int(self.free_tail[page]),
+        )
 
 
 class NVS_Page:
-    def __init__(self, page_data: bytearray, address: int):
+    def __init__(
+        self, page_data: Union[bytes, bytearray, memoryview], address: int, row: Optional[NVS_Page_Row] = None
+    ):
         if len(page_data) != nvs_const.page_size:
             raise NotAlignedError(
                 f'Size of given page does not match page size ({len(page_data)} != {nvs_const.page_size})'
             )
 
         # Initialize class
-        self.is_empty = (
-            page_data[0: nvs_const.entry_size]
-            == bytearray({0xFF}) * nvs_const.entry_size
-        )
+        page_data = memoryview(page_data)
+        self._data = page_data
+        self.is_empty = page_data[0: nvs_const.entry_size] == _EMPTY_ENTRY_DATA
         self.start_address = address
-        self.raw_header = page_data[0: nvs_const.entry_size]
-        self.raw_entry_state_bitmap = page_data[
-            nvs_const.entry_size: 2 * nvs_const.entry_size
-        ]
-        self.entries = []
+        self.entries: Sequence[NVS_Entry] = []
+
+        # Freshly erased page (all 0xFF) is detected with a single comparison and shares
+        # its header row and (free) entries with all other erased pages
+        erased = page_data == _EMPTY_PAGE_DATA
+        if erased:
+            row = _EMPTY_PAGE_ROW
 
-        # Load header
+        # Load header and entry state bitmap (unless already decoded into a table row)
+        if row is None:
+            row = decode_page_row(page_data)
+        self.crc_original = row.crc
+        self._crc_computed: Optional[int] = None
         self.header: Dict[str, Any] = {
-            'status': nvs_const.page_status.get(
-                int.from_bytes(page_data[0:4], byteorder='little'), 'Invalid'
-            ),
-            'page_index': int.from_bytes(page_data[4:8], byteorder='little'),
-            'version': 256 - page_data[8],
-            'crc': {
-                'original': int.from_bytes(page_data[28:32], byteorder='little'),
-                'computed': crc32(page_data[4:28], 0xFFFFFFFF),
-            },
+            'status': nvs_const.page_status.get(row.status, 'Invalid'),
+            'page_index': row.page_index,
+            'version': 256 - row.version,
+            # Weak reference, the page would otherwise be part of a reference cycle and keep its view
+            # of the image (and a mapping of the file) alive until the cyclic garbage collector runs
+            'crc': NVS_CRC(weakref.proxy(self), ('original', 'computed')),
         }
+        if erased:
+            self.entries = _EMPTY_PAGE_ENTRIES
+            return
+        entry_states = [_STATE_NAMES[state] for state in row.states]
 
-        # Load entry state bitmap
-        entry_states = []
-        for c in self.raw_entry_state_bitmap:
-            for index in range(0, 8, 2):
-                entry_states.append(
-                    nvs_const.entry_status.get((c >> index) & 3, 'Invalid')
-                )
-        entry_states = entry_states[:-2]
+        # Find the run of free (all 0xFF) entries at the end of the page, these are not decoded
+        free_tail = int(nvs_const.page_size / nvs_const.entry_size) if row.free_tail is None else row.free_tail
+        while row.free_tail is None and free_tail > 2 and (
+            page_data[(free_tail - 1) * nvs_const.entry_size: free_tail * nvs_const.entry_size]
+            == _EMPTY_ENTRY_DATA
+        ):
+            free_tail -= 1
 
         # Load entries
         i = 2
-        while i < int(
-            nvs_const.page_size / nvs_const.entry_size
-        ):  # Loop through every entry
+        if row.key is not None:  # Fully decoded row, entries are built from its columns without decoding
+            self.entries, i = _row_entries(page_data, row, entry_states, free_tail)
+        while i < free_tail:  # Loop through every entry
             span = page_data[(i * nvs_const.entry_size) + 2]
             if span in [0xFF, 0]:  # 'Default' span length to prevent span overflow
                 span = 1
@@ -128,8 +899,9 @@ class NVS_Page:
             # Load an entry
             entry = NVS_Entry(
                 index=(i - 2),
-                entry_data=page_data[i * nvs_const.entry_size: (i + 1) * nvs_const.entry_size],
+                entry_data=page_data,
                 entry_state=entry_states[i - 2],
+                offset=i * nvs_const.entry_size,
             )
             self.entries.append(entry)
 
@@ -142,17 +914,79 @@ class NVS_Page:
                         break
                     child_entry = NVS_Entry(
                         index=entry_idx,
-                        entry_data=page_data[
-                            page_addr
-                            * nvs_const.entry_size: (page_addr + 1)
-                            * nvs_const.entry_size
-                        ],
+                        entry_data=page_data,
                         entry_state=entry_states[entry_idx],
+                        offset=page_addr * nvs_const.entry_size,
                     )
                     entry.child_assign(child_entry)
-                entry.compute_crc()
             i += span
 
+        # Free entries at the end of the page are shared (see empty_entry())
+        for i in range(i, int(nvs_const.page_size / nvs_const.entry_size)):
+            self.entries.append(empty_entry(i - 2, entry_states[i - 2]))
+
+    def rebind(self, page_data: memoryview) -> None:
+        """Moves the page and its entries over to `page_data`, which has to hold the same bytes (e.g. a reloaded image)
+        """
+        self._data = page_data
+        for entry in self.entries:
+            if isinstance(entry, NVS_Empty_Entry):  # Shared, not bound to any page
+                continue
+            entry._buffer = page_data
+            for child in entry.children:
+                child._buffer = page_data
+
+    def row(self) -> NVS_Page_Row:
+        """Returns the fully decoded row of the page, a page built from it skips all header, key and free entry decoding
+        """
+        row = decode_page_row(self._data)
+        columns: Dict[str, List[Any]] = {field: [None] * len(row.states) for field in _ENTRY_COLUMNS}
+        free_tail = int(nvs_const.page_size / nvs_const.entry_size)
+        for entry in self.entries:
+            if isinstance(entry, NVS_Empty_Entry):
+                free_tail = min(free_tail, entry.index + 2)
+            for e in (entry, *entry.children):
+                for field, attr in _ENTRY_COLUMNS.items():
+                    columns[field][e.index] = getattr(e, attr)
+        return row._replace(free_tail=free_tail, **columns)  # type: ignore
+
+    @property
+    def crc_computed(self) -> int:
+        if self._crc_computed is None:
+            self._crc_computed = crc32(self._data[4:28], 0xFFFFFFFF)
+        return self._crc_computed
+
+    def verify_crcs(self, states: Optional[Container[str]] = ('Written',)) -> List[NVS_CRC_Mismatch]:
+        """Verifies the page header CRC32 (unless the header is empty) and CRC32 of entries in given states
+        (all states if None) and their data, free entries are always skipped. Returns only mismatches.
+        """
+        page_no = self.start_address // nvs_const.page_size
+        mismatches = []
+        if not self.is_empty and self.crc_original != self.crc_computed:
+            mismatches.append(NVS_CRC_Mismatch(page_no, None, 'page', self.crc_original, self.crc_computed))
+        for entry in self.entries:
+            if entry.state == 'Empty' and entry.is_empty:
+                continue
+            if states is not None and entry.state not in states:
+                continue
+            if entry.crc_original != entry.crc_computed:
+                mismatches.append(
+                    NVS_CRC_Mismatch(page_no, entry.index, 'entry', entry.crc_original, entry.crc_computed)
+                )
+            if entry.span > 1 and entry.crc_data_original != entry.crc_data_computed:
+                mismatches.append(
+                    NVS_CRC_Mismatch(page_no, entry.index, 'data', entry.crc_data_original, entry.crc_data_computed)
+                )
+        return mismatches
+
+    @property
+    def raw_header(self) -> bytearray:
+        return bytearray(self._data[0: nvs_const.entry_size])
+
+    @property
+    def raw_entry_state_bitmap(self) -> bytearray:
+        return bytearray(self._data[nvs_const.entry_size: 2 * nvs_const.entry_size])
+
     def toJSON(self) -> Dict[str, Any]:
         return dict(
             is_empty=self.is_empty,
@@ -164,96 +998,279 @@ class NVS_Page:
         )
 
 
+# NVS_Page_Row entry column -> NVS_Entry attribute
+_ENTRY_COLUMNS = {
+    'namespace': 'namespace',
+    'item_type': 'item_type',
+    'span': 'span',
+    'chunk_index': 'chunk_index',
+    'entry_crc': 'crc_original',
+    'data_crc': 'crc_data_original',
+    'key': 'key',
+    'is_empty': 'is_empty',
+}
+
+
+def _row_entries(
+    page_data: memoryview, row: NVS_Page_Row, entry_states: List[str], free_tail: int
+) -> Tuple[List['NVS_Entry'], int]:
+    """Builds entries of a page up to `free_tail` from its fully decoded row (see `NVS_Page.row()`),
+    returns them with the entry number (from page start) the free entries start at
+    """
+    headers = list(zip(
+        row.namespace, row.item_type, row.span, row.chunk_index,  # type: ignore
+        row.entry_crc, row.data_crc, row.key, row.is_empty,  # type: ignore
+    ))
+    page_entries = nvs_const.page_size // nvs_const.entry_size
+    entries = []
+    i = 2
+    while i < free_tail:
+        entry = NVS_Entry._from_header(i - 2, page_data, entry_states[i - 2], headers[i - 2])
+        entries.append(entry)
+        span = entry.span
+        if span in (0xFF, 0):  # 'Default' span length to prevent span overflow
+            span = 1
+        if span != 1:
+            children = [
+                NVS_Entry._from_header(e, page_data, entry_states[e], headers[e])
+                for e in range(i - 1, min(i + span, page_entries) - 2)
+            ]
+            for child in children:
+                # Data entries have no data CRC of their own, see `NVS_Entry.child_assign()`
+                child._crc_data_computed = 0
+            entry.children = children
+        i += span
+    return entries, i
+
+
+def _number_decoder(i_type: int) -> Callable[[memoryview], Dict]:
+    byte_size_mask = 0x0F
+    number_sign_mask = 0xF0
+    size = i_type & byte_size_mask
+    number = struct.Struct('<' + {1: 'b', 2: 'h', 4: 'i', 8: 'q'}[size])
+    if not i_type & number_sign_mask:
+        number = struct.Struct(number.format.upper())
+    unpack_from = number.unpack_from
+    return lambda data: {'value': unpack_from(data)[0]}
+
+
+_VARIABLE_DATA = struct.Struct('<H2xI')  # size, (reserved), CRC32 of data
+_BLOB_INDEX_DATA = struct.Struct('<IBB')  # size, chunk count, chunk start
+
+
+def _variable_data_decoder(data: memoryview) -> Dict:
+    size, crc = _VARIABLE_DATA.unpack_from(data)
+    return {'value': [size, crc], 'size': size, 'crc': crc}
+
+
+def _blob_index_decoder(data: memoryview) -> Dict:
+    size, chunk_count, chunk_start = _BLOB_INDEX_DATA.unpack_from(data)
+    return {
+        'value': [size, chunk_count, chunk_start],
+        'size': size,
+        'chunk_count': chunk_count,
+        'chunk_start': chunk_start,
+    }
+
+
+def _value_decoders() -> Dict[int, Callable[[memoryview], Dict]]:
+    fixed_entry_length_threshold = (
+        0x20  # Fixed length entry type number is always smaller than this
+    )
+    decoders = {}
+    for i_type, type_name in nvs_const.item_type.items():
+        if i_type < fixed_entry_length_threshold:
+            decoders[i_type] = _number_decoder(i_type)
+        elif type_name in ['string', 'blob_data', 'blob']:
+            decoders[i_type] = _variable_data_decoder
+        elif type_name == 'blob_index':
+            decoders[i_type] = _blob_index_decoder
+    return decoders
+
+
+# Item type -> decoder of the 8 data bytes of an entry
+_VALUE_DECODERS = _value_decoders()
+
+
+def item_convert(i_type: int, data: memoryview) -> Dict:
+    decoder = _VALUE_DECODERS.get(i_type)
+    if decoder is None:
+        return {'value': None}
+    return decoder(data)
+
+
+def namespace_definition(
+    namespace: int, key: Optional[str], item_type: int, data: Union[bytes, memoryview]
+) -> Optional[Tuple[Any, str]]:
+    """Returns (namespace index, namespace name) defined by a written entry, None if the entry is not
+    a namespace definition. Every entry of namespace 0 with a valid key is one (whatever its type), its value
+    is the index. Shared by `NVS_Index` and `scan_namespaces()`, so both see the same namespaces
+    """
+    if namespace != 0 or key is None:
+        return None
+    return item_convert(item_type, memoryview(data))['value'], key
+
+
+def key_decode(data: Union[bytes, memoryview]) -> Optional[str]:
+    try:
+        return bytes(data).rstrip(b'\x00').decode('ascii')
+    except UnicodeDecodeError:
+        return None
+
+
+# Entry: namespace, type, span, chunk index, CRC32, key, data (data CRC32 of variable length items in last 4 bytes)
+_ENTRY = struct.Struct('<BBBBI16s8s')
+_DATA_CRC = struct.Struct('<4xI')
+
+
 class NVS_Entry:
-    def __init__(self, index: int, entry_data: bytearray, entry_state: str):
-        if len(entry_data) != nvs_const.entry_size:
+    # Entries are by far the most numerous objects, keep them free of per-instance dicts.
+    # `metadata` and `data` are rebuilt from the fields below on access
+    __slots__ = (
+        '_buffer',
+        '_offset',
+        'state',
+        'is_empty',
+        'index',
+        'page',
+        'namespace',
+        'item_type',
+        'span',
+        'chunk_index',
+        'crc_original',
+        '_crc_computed',
+        'crc_data_original',
+        '_crc_data_computed',
+        'key',
+        'children',
+    )
+
+    def __init__(
+        self,
+        index: int,
+        entry_data: Union[bytes, bytearray, memoryview],
+        entry_state: str,
+        offset: Optional[int] = None,
+    ):
+        # Entries created by NVS_Page only keep a reference to the (shared) page buffer and their offset in it
+        if offset is None:
+            if len(entry_data) != nvs_const.entry_size:
+                raise NotAlignedError(
+                    f'Given entry is not aligned to entry size ({len(entry_data)} % {nvs_const.entry_size} = {len(entry_data)%nvs_const.entry_size})'
+                )
+            offset = 0
+        elif offset + nvs_const.entry_size > len(entry_data):
             raise NotAlignedError(
-                f'Given entry is not aligned to entry size ({len(entry_data)} % {nvs_const.entry_size} = {len(entry_data)%nvs_const.entry_size})'
+                f'Given entry does not fit into the buffer ({offset} + {nvs_const.entry_size} > {len(entry_data)})'
             )
 
-        def item_convert(i_type: int, data: bytearray) -> Dict:
-            byte_size_mask = 0x0F
-            number_sign_mask = 0xF0
-            fixed_entry_length_threshold = (
-                0x20  # Fixed length entry type number is always smaller than this
-            )
-            if i_type in nvs_const.item_type:
-                # Deal with non variable length entries
-                if i_type < fixed_entry_length_threshold:
-                    size = i_type & byte_size_mask
-                    num = int.from_bytes(
-                        data[:size],
-                        byteorder='little',
-                        signed=bool(i_type & number_sign_mask),
-                    )
-                    return {'value': num}
-
-                # Deal with variable length entries
-                if nvs_const.item_type[i_type] in ['string', 'blob_data', 'blob']:
-                    size = int.from_bytes(data[:2], byteorder='little')
-                    crc = int.from_bytes(data[4:8], byteorder='little')
-                    return {'value': [size, crc], 'size': size, 'crc': crc}
-                if nvs_const.item_type[i_type] == 'blob_index':
-                    size = int.from_bytes(data[:4], byteorder='little')
-                    chunk_count = data[4]
-                    chunk_start = data[5]
-                    return {
-                        'value': [size, chunk_count, chunk_start],
-                        'size': size,
-                        'chunk_count': chunk_count,
-                        'chunk_start': chunk_start,
-                    }
-
-            return {'value': None}
-
-        def key_decode(data: bytearray) -> Optional[str]:
-            decoded = ''
-            for n in data.rstrip(b'\x00'):
-                char = chr(n)
-                if char.isascii():
-                    decoded += char
-                else:
-                    return None
-            return decoded
-
-        self.raw = entry_data
+        self._buffer = entry_data if isinstance(entry_data, memoryview) else memoryview(entry_data)
+        self._offset = offset
         self.state = entry_state
-        self.is_empty = self.raw == bytearray({0xFF}) * nvs_const.entry_size
         self.index = index
-        self.page = None
-
-        namespace = self.raw[0]
-        entry_type = self.raw[1]
-        span = self.raw[2]
-        chunk_index = self.raw[3]
-        crc = self.raw[4:8]
-        key = self.raw[8:24]
-        data = self.raw[24:32]
-        raw_without_crc = self.raw[:4] + self.raw[8:32]
-        self.metadata: Dict[str, Any] = {
-            'namespace': namespace,
-            'type': nvs_const.item_type.get(entry_type, f'0x{entry_type:02x}'),
-            'span': span,
-            'chunk_index': chunk_index,
-            'crc': {
-                'original': int.from_bytes(crc, byteorder='little'),
-                'computed': crc32(raw_without_crc, 0xFFFFFFFF),
-                'data_original': int.from_bytes(data[-4:], byteorder='little'),
-                'data_computed': 0,
-            },
-        }
-        self.children: List['NVS_Entry'] = []
+        self.page: Optional['NVS_Page'] = None
+        # Computed CRCs are calculated on first access
+        self._crc_computed: Optional[int] = None
+        self._crc_data_computed: Optional[int] = None
+        # Only entries spanning over data entries get their own list, see child_assign()
+        self.children: Sequence['NVS_Entry'] = ()
+
+        (
+            self.namespace, self.item_type, self.span, self.chunk_index, self.crc_original, key, data
+        ) = _ENTRY.unpack_from(self._buffer, offset)
+        self.is_empty = self._buffer[offset: offset + nvs_const.entry_size] == _EMPTY_ENTRY_DATA
+        self.crc_data_original = _DATA_CRC.unpack(data)[0]
         self.key = key_decode(key)
+
+    @classmethod
+    def _from_header(
+        cls, index: int, page_data: memoryview, entry_state: str, header: Tuple[Any, ...]
+    ) -> 'NVS_Entry':
+        """Creates an entry of a page from its already decoded (namespace, type, span, chunk index, CRC32,
+        data CRC32, key, is_empty) header fields without any checks
+        """
+        entry = cls.__new__(cls)
+        entry._buffer = page_data
+        entry._offset = (index + 2) * nvs_const.entry_size
+        entry.state = entry_state
+        entry.index = index
+        entry.page = None
+        entry._crc_computed = None
+        entry._crc_data_computed = None
+        entry.children = ()
+        (
+            entry.namespace,
+            entry.item_type,
+            entry.span,
+            entry.chunk_index,
+            entry.crc_original,
+            entry.crc_data_original,
+            entry.key,
+            entry.is_empty,
+        ) = header
+        return entry
+
+    @property
+    def crc_computed(self) -> int:
+        if self._crc_computed is None:
+            raw = self._raw
+            # CRC32 of the entry without its CRC field (bytes 4-7)
+            self._crc_computed = crc32(raw[8:32], crc32(raw[:4], 0xFFFFFFFF))
+        return self._crc_computed
+
+    @property
+    def crc_data_computed(self) -> int:
+        if self._crc_data_computed is None:
+            if self.span in [0xFF, 0, 1]:  # Entry has no data entries
+                self._crc_data_computed = 0
+            else:
+                self.compute_crc()
+        return self._crc_data_computed  # type: ignore
+
+    @property
+    def type_name(self) -> str:
+        return nvs_const.item_type.get(self.item_type, f'0x{self.item_type:02x}')
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return {
+            'namespace': self.namespace,
+            'type': self.type_name,
+            'span': self.span,
+            'chunk_index': self.chunk_index,
+            'crc': NVS_CRC(self, ('original', 'computed', 'data_original', 'data_computed')),
+        }
+
+    @property
+    def data(self) -> Optional[Dict[str, Any]]:
         if self.key is None:
-            self.data = None
-        else:
-            self.data = item_convert(entry_type, data)
+            return None
+        return item_convert(self.item_type, self._raw[24:32])
+
+    @property
+    def _raw(self) -> memoryview:
+        return self._buffer[self._offset: self._offset + nvs_const.entry_size]
+
+    @property
+    def raw(self) -> bytearray:
+        return bytearray(self._raw)
+
+    def value_view(self) -> 'NVS_Value':
+        """Returns data of a string, blob or blob chunk as a window into its data entries (without padding)
+        """
+        start = self._offset + nvs_const.entry_size
+        size = len(self.children) * nvs_const.entry_size
+        data = self.data
+        if data is not None and data.get('size'):
+            size = min(size, data['size'])
+        return NVS_Value([self._buffer[start: start + size]])
 
     def dump_raw(self) -> str:
         hex_bytes = ''
         decoded = ''
-        for i, c in enumerate(self.raw):
-            middle_index = int(len(self.raw) / 2)
+        raw = self._raw
+        for i, c in enumerate(raw):
+            middle_index = int(len(raw) / 2)
             if i == middle_index:  # Add a space in the middle
                 hex_bytes += ' '
                 decoded += ' '
@@ -264,20 +1281,32 @@ class NVS_Entry:
     def child_assign(self, entry: 'NVS_Entry') -> None:
         if not isinstance(entry, type(self)):
             raise ValueError('You can assign only NVS_Entry')
+        if not isinstance(self.children, list):
+            self.children = []
+        # Data entries have no data CRC of their own, whatever their bytes say
+        entry._crc_data_computed = 0
         self.children.append(entry)
 
     def compute_crc(self) -> None:
-        if self.metadata['span'] == 1:
+        if self.span == 1:
             return
-        # Merge entries into one buffer
-        children_data = bytearray()
+        size = None
+        data = self.data
+        if data:
+            if data['value'] is not None:
+                if data['size']:
+                    size = data['size']  # Discard padding
+        # Feed children into the CRC one by one instead of merging them into one buffer
+        crc = 0xFFFFFFFF
         for entry in self.children:
-            children_data += entry.raw
-        if self.data:
-            if self.data['value'] is not None:
-                if self.data['size']:
-                    children_data = children_data[: self.data['size']]  # Discard padding
-        self.metadata['crc']['data_computed'] = crc32(children_data, 0xFFFFFFFF)
+            if size is not None:
+                if size <= 0:
+                    break
+                crc = crc32(entry._raw[:size], crc)
+                size -= nvs_const.entry_size
+            else:
+                crc = crc32(entry._raw, crc)
+        self._crc_data_computed = crc
 
     def toJSON(self) -> Dict[str, Any]:
         return dict(
@@ -290,3 +1319,133 @@ class NVS_Entry:
             data=self.data,
             children=self.children,
         )
+
+
+class NVS_Empty_Entry(NVS_Entry):
+    """Free (all 0xFF) entry which is shared by all pages, see `empty_entry()`
+
+    Shared entries are immutable and not bound to any page, their CRCs are computed once
+    """
+    __slots__ = ('_frozen',)
+
+    def __init__(self, index: int, entry_state: str):
+        super().__init__(index, _EMPTY_ENTRY_DATA, entry_state)
+        self.crc_computed
+        self.crc_data_computed
+        self._frozen = True
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if getattr(self, '_frozen', False):
+            raise AttributeError(f'Shared empty entry cannot be modified ({name})')
+        super().__setattr__(name, value)
+
+
+_EMPTY_ENTRY_DATA = bytes([0xFF]) * nvs_const.entry_size
+_EMPTY_PAGE_DATA = bytes([0xFF]) * nvs_const.page_size
+_EMPTY_PAGE_ROW = decode_page_row(memoryview(_EMPTY_PAGE_DATA))
+_empty_entries: Dict[Tuple[int, str], NVS_Empty_Entry] = {}
+
+
+def empty_entry(index: int, entry_state: str) -> NVS_Empty_Entry:
+    """Returns the shared free entry for the given entry index and state
+    """
+    entry = _empty_entries.get((index, entry_state))
+    if entry is None:
+        entry = _empty_entries[(index, entry_state)] = NVS_Empty_Entry(index, entry_state)
+    return entry
+
+
+_EMPTY_PAGE_ENTRIES: Tuple[NVS_Empty_Entry, ...] = tuple(
+    empty_entry(i, nvs_const.entry_status[0b11]) for i in range(len(_EMPTY_PAGE_ROW.states))
+)
+
+
+class NVS_Item(NamedTuple):
+    """Lightweight decoded entry yielded by `iter_entries()`, it holds no reference to the image
+    """
+    page: int  # Page number (position in the partition)
+    entry: int  # Entry index
+    state: str
+    namespace: int
+    key: Optional[str]
+    type: str
+    span: int
+    chunk_index: int
+    # Number for primitive types, [size, chunk_count, chunk_start] for blob indexes
+    # and the data (without padding) for strings and blob data
+    value: Any
+
+
+def entry_value(entry: NVS_Entry, copy: bool = True) -> Any:
+    """Returns decoded value of the entry, data of strings and blobs are read from its data entries
+    (as bytes, or as `NVS_Value` window into the image if `copy` is False)
+    """
+    data = entry.data
+    if data is None:
+        return None
+    if entry.type_name in ['string', 'blob_data', 'blob']:
+        value = entry.value_view()
+        return value.tobytes() if copy else value
+    return data['value']
+
+
+def iter_entries(
+    source: Union[BinaryIO, bytes, bytearray, memoryview, mmap.mmap], written_only: bool = False
+) -> Iterator[NVS_Item]:
+    """Decodes a partition page by page and yields its entries (free entries and data entries are skipped)
+
+    `source` is either a buffer or a binary file object (e.g. `sys.stdin.buffer`), which is read one page
+    at a time, so memory usage does not depend on the size of the partition
+    """
+    if isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        buffer = memoryview(source)
+        pages: Iterable[Union[bytes, memoryview]] = (
+            buffer[i: i + nvs_const.page_size] for i in range(0, len(buffer), nvs_const.page_size)
+        )
+    else:
+        pages = iter(lambda: source.read(nvs_const.page_size), b'')  # type: ignore
+
+    for page_no, page_data in enumerate(pages):
+        if len(page_data) != nvs_const.page_size:
+            raise NotAlignedError(
+                f'Given partition data is not aligned to page size (page {page_no} has only {len(page_data)} B)'
+            )
+        page = NVS_Page(page_data, page_no * nvs_const.page_size)
+        for entry in page.entries:
+            if entry.state == 'Empty' and entry.is_empty:
+                continue
+            if written_only and entry.state != 'Written':
+                continue
+            yield NVS_Item(
+                page=page_no,
+                entry=entry.index,
+                state=entry.state,
+                namespace=entry.namespace,
+                key=entry.key,
+                type=entry.type_name,
+                span=entry.span,
+                chunk_index=entry.chunk_index,
+                value=entry_value(entry),
+            )
+
+
+def scan_namespaces(raw_data: Union[bytes, bytearray, memoryview, mmap.mmap]) -> Dict[int, str]:
+    """Returns namespace index -> namespace name map read straight from the entry headers of written
+    namespace definitions, no page is decoded. Later pages (by page sequence number, physical order on ties) win like in `NVS_Index`
+    """
+    buffer = memoryview(raw_data)
+    found: List[Tuple[int, int, int, Any, str]] = []
+    for address in range(0, len(buffer) - nvs_const.page_size + 1, nvs_const.page_size):
+        row = decode_page_row(buffer[address: address + nvs_const.page_size])
+        if row.status == 0xFFFFFFFF:  # Empty page
+            continue
+        for i in [i for i, state in enumerate(row.states) if state == 0b10]:  # Written entries
+            namespace, item_type, _, _, _, raw_key, data = _ENTRY.unpack_from(
+                buffer, address + (i + 2) * nvs_const.entry_size
+            )
+            if namespace != 0:
+                continue
+            definition = namespace_definition(namespace, key_decode(raw_key), item_type, data)
+            if definition is not None:
+                found.append((row.page_index, address, i, *definition))
+    return {ns_index: key for _, _, _, ns_index, key in sorted(found)}
@@ -2,27 +2,133 @@
 # SPDX-FileCopyrightText: 2022-2024 Espressif Systems (Shanghai) CO LTD
 # SPDX-License-Identifier: Apache-2.0
 import argparse
+import glob
+import json
 import os
 import sys
 import traceback
+from typing import Any
+from typing import Dict
+from typing import List
 
 import nvs_check
+import nvs_gc
 import nvs_logger
 import nvs_parser
 from nvs_logger import nvs_log
 from nvs_parser import nvs_const
 
 
+def parse_checks(value: str) -> List[str]:
+    checks = [check.strip() for check in value.split(',') if check.strip()]
+    unknown = [check for check in checks if check not in nvs_check.CHECKS]
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            f'unknown check {", ".join(unknown)} (choose from {", ".join(nvs_check.CHECKS)})'
+        )
+    return checks
+
+
+def parse_fields(value: str) -> List[str]:
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in nvs_logger.NDJSON_FIELDS]
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            f'unknown field {", ".join(unknown)} (choose from {", ".join(nvs_logger.NDJSON_FIELDS)})'
+        )
+    return fields
+
+
 def program_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
         description='Parse NVS partition', formatter_class=argparse.RawTextHelpFormatter
     )
-    parser.add_argument('file', help='Path to dumped NVS partition')
+    parser.add_argument(
+        'file',
+        nargs='+',
+        help='Path to dumped NVS partition (\'-\' reads from stdin in --stream mode),\n'
+        + 'several paths, directories or glob patterns check all the files in a batch\n'
+        + '(implies --integrity-check, nothing is dumped)',
+    )
+    parser.add_argument(
+        '--flash-image',
+        action='store_true',
+        help='file is a full flash image, parse its NVS partitions found by the partition table',
+    )
+    parser.add_argument(
+        '--partition',
+        metavar='NAME',
+        help='with --flash-image parse only the NVS partition called NAME',
+    )
+    parser.add_argument(
+        '--table-offset',
+        type=lambda x: int(x, 0),
+        metavar='OFFSET',
+        help=f'with --flash-image offset of the partition table (default: 0x{nvs_parser.PARTITION_TABLE_OFFSET:x})',
+    )
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='decode the partition page by page and print entries as they are found\n'
+        + '(constant memory, works with pipes, --dump and --integrity-check are ignored)',
+    )
+    parser.add_argument(
+        '--cache-dir',
+        default=os.environ.get('NVS_CACHE_DIR'),
+        metavar='DIR',
+        help='cache decoded partitions in DIR and reuse them when the same image is opened again\n'
+        + '(default: $NVS_CACHE_DIR, no caching if not set)',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        metavar='N',
+        help='decode pages in N worker processes (0 = one per CPU, default: 1 = no worker processes)',
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        type=int,
+        default=1,
+        metavar='N',
+        help='check files of a batch in N worker processes (0 = one per CPU, default: 1 = no worker processes)',
+    )
     parser.add_argument(
         '-i',
         '--integrity-check',
         action='store_true',
-        help='check partition for potential errors',
+        help='check partition for potential errors (exit code 2 if any error is found)',
+    )
+    parser.add_argument(
+        '--checks',
+        type=parse_checks,
+        default=list(nvs_check.CHECKS),
+        metavar='LIST',
+        help=f'with -i run only the given comma separated checks (default: {",".join(nvs_check.CHECKS)})',
+    )
+    parser.add_argument(
+        '--fail-fast',
+        action='store_true',
+        help='with -i stop checking at the first error',
+    )
+    tmp = {
+        'text': 'print the integrity check report as a human-readable text',
+        'json': 'print findings of the integrity check as a single JSON document',
+        'ndjson': 'print findings of the integrity check as JSON objects, one per line',
+    }
+    parser.add_argument(
+        '--findings',
+        choices=tmp,
+        default='text',
+        help='\n'.join(f'{opt} - {tmp[opt]}' for opt in tmp),
+    )
+    parser.add_argument(
+        '--findings-file',
+        type=argparse.FileType('w'),
+        metavar='FILE',
+        help='write json and ndjson findings to FILE instead of stdout\n'
+        + '(required with -f json or ndjson, both documents would be mixed up on stdout)',
     )
     tmp = {
         'all': 'print written, erased and empty entries',
@@ -31,6 +137,7 @@ def program_args() -> argparse.Namespace:
         'blobs': 'print all blobs and strings',
         'namespaces': 'list all written namespaces',
         'storage_info': 'print storage related information (free/used entries, etc)',
+        'gc': 'analyze free space and garbage collection pressure (JSON with -f json, see --write-type)',
         'none': 'do not print anything (if you only want to do integrity check)',
     }
     parser.add_argument(
@@ -50,17 +157,161 @@ def program_args() -> argparse.Namespace:
         default='auto',
         help='Enable color (ANSI)',
     )
+    parser.add_argument(
+        '--write-size',
+        type=int,
+        default=nvs_const.entry_size,
+        metavar='BYTES',
+        help='with -d gc size of the value used to estimate writes left before a garbage collection\n'
+        + '(default: %(default)s)',
+    )
+    parser.add_argument(
+        '--write-type',
+        choices=nvs_gc.WRITE_TYPES,
+        help='with -d gc item type of the value: int (up to 8 B, a single entry), string (up to 4000 B\n'
+        + 'in a single page) or blob (chunks across pages and a blob index entry),\n'
+        + 'default: int for values up to 8 B, string up to 4000 B, blob otherwise',
+    )
     tmp = {
         'text': 'print output as a human-readable text',
         'json': 'print output as JSON and exit',
+        'ndjson': 'print written entries as JSON objects, one per line, and exit',
     }
     parser.add_argument(
         '-f', '--format', choices=tmp, default='text', help='Output format'
     )
-    return parser.parse_args()
+    parser.add_argument(
+        '--fields',
+        type=parse_fields,
+        default=list(nvs_logger.NDJSON_DEFAULT_FIELDS),
+        metavar='LIST',
+        help='with -f ndjson comma separated fields of every entry, others are not computed at all\n'
+        + f'(choose from {",".join(nvs_logger.NDJSON_FIELDS)}, default: {",".join(nvs_logger.NDJSON_DEFAULT_FIELDS)})',
+    )
+    parser.add_argument(
+        '--json-compact',
+        action='store_true',
+        help='with -f json print JSON without indentation and leave out empty entries',
+    )
+    args = parser.parse_args()
+    if args.stream and len(args.file) != 1:
+        parser.error('--stream takes a single file')
+    if not args.flash_image:
+        if args.partition is not None:
+            parser.error('--partition requires --flash-image')
+        if args.table_offset is not None:
+            parser.error('--table-offset requires --flash-image')
+    if args.table_offset is None:
+        args.table_offset = nvs_parser.PARTITION_TABLE_OFFSET
+    if args.integrity_check and args.format != 'text' and args.findings != 'text' and args.findings_file is None:
+        parser.error(f'-f {args.format} with --findings {args.findings} requires --findings-file')
+    if args.findings_file is None:
+        args.findings_file = sys.stdout
+    if args.write_type is None:
+        args.write_type = 'int' if args.write_size <= 8 else 'string' if args.write_size <= 4000 else 'blob'
+    try:
+        nvs_gc.writes_before_gc([], args.write_size, args.write_type)
+    except ValueError as e:
+        parser.error(f'--write-size: {e}')
+    return args
+
+
+def expand_paths(patterns: List[str]) -> List[str]:
+    """Expands directories (files directly inside) and glob patterns to a list of files
+    """
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.extend(sorted(
+                os.path.join(pattern, name) for name in os.listdir(pattern)
+                if os.path.isfile(os.path.join(pattern, name))
+            ))
+        elif glob.has_magic(pattern):  # Patterns are not expanded by shells on Windows
+            paths.extend(sorted(path for path in glob.glob(pattern) if os.path.isfile(path)))
+        else:
+            paths.append(pattern)
+    return paths
+
 
+def check_batch(args: argparse.Namespace, paths: List[str]) -> int:
+    """Checks all the files, prints findings of every file as soon as it is checked and a summary at the end
+    """
+    options = dict(
+        checks=args.checks,
+        fail_fast=args.fail_fast,
+        flash_image=args.flash_image,
+        name=args.partition,
+        table_offset=args.table_offset,
+        cache_dir=args.cache_dir,
+        workers=args.workers,
+    )
+    files: List[Dict[str, Any]] = []
+    codes: Dict[str, int] = {}
+    for path, findings in nvs_check.check_files(paths, args.jobs, **options):
+        errors = sum(finding.severity == 'error' for finding in findings)
+        warnings = len(findings) - errors
+        files.append({'file': path, 'errors': errors, 'warnings': warnings, 'findings': findings})
+        for finding in findings:
+            codes[finding.code] = codes.get(finding.code, 0) + 1
+
+        if args.findings == 'ndjson':
+            for finding in findings:
+                print(json.dumps({'file': path, **finding._asdict()}), file=args.findings_file, flush=True)
+        elif args.findings == 'text':
+            if errors:
+                status = nvs_log.red(f'{errors} errors, {warnings} warnings')
+            elif warnings:
+                status = nvs_log.yellow(f'{warnings} warnings')
+            else:
+                status = nvs_log.green('OK')
+            nvs_log.info(f'{path}:', status)
+            for finding in findings:
+                where = ''.join([
+                    f' [{finding.partition}]' if args.flash_image else '',
+                    f' page {finding.page}' if finding.page is not None else '',
+                    f' entry #{finding.entry:03d}' if finding.entry is not None else '',
+                ])
+                color = nvs_log.red if finding.severity == 'error' else nvs_log.yellow
+                nvs_log.info(f'  {color(finding.code)}{where}: {finding.message}')
+            sys.stdout.flush()
+
+    # Files with most errors first, then by warnings
+    worst = sorted(
+        (f for f in files if f['errors'] or f['warnings']), key=lambda f: (-f['errors'], -f['warnings'], f['file'])
+    )[:10]
+    summary: Dict[str, Any] = {
+        'files': len(files),
+        'ok': sum(not f['errors'] and not f['warnings'] for f in files),
+        'with_errors': sum(bool(f['errors']) for f in files),
+        'with_warnings': sum(not f['errors'] and bool(f['warnings']) for f in files),
+        'codes': dict(sorted(codes.items(), key=lambda item: (-item[1], item[0]))),
+        'worst': [{'file': f['file'], 'errors': f['errors'], 'warnings': f['warnings']} for f in worst],
+    }
 
-def main() -> None:
+    if args.findings == 'json':
+        for f in files:
+            f['findings'] = [finding._asdict() for finding in f['findings']]
+        print(json.dumps({'files': files, 'summary': summary}, indent=2), file=args.findings_file)
+    elif args.findings == 'ndjson':
+        print(json.dumps({'summary': summary}), file=args.findings_file)
+    else:
+        nvs_log.info()
+        nvs_log.info(
+            nvs_log.cyan(f'Checked {summary["files"]} files:'),
+            f'{summary["ok"]} OK, {summary["with_errors"]} with errors, {summary["with_warnings"]} with warnings only',
+        )
+        if codes:
+            nvs_log.info(nvs_log.cyan('Findings by type:'))
+            for code, count in summary['codes'].items():
+                nvs_log.info(f'  {code:<24}{count}')
+            nvs_log.info(nvs_log.cyan('Worst files:'))
+            for f in summary['worst']:
+                nvs_log.info(f'  {f["file"]}: {f["errors"]} errors, {f["warnings"]} warnings')
+
+    return 2 if summary['with_errors'] else 0
+
+
+def main() -> int:
     args = program_args()
 
     if nvs_const.entry_size != 32:
@@ -69,9 +320,22 @@ def main() -> None:
     nvs_log.set_color(args.color)
     nvs_log.set_format(args.format)
 
+    if args.stream:
+        if args.file[0] == '-':
+            nvs_logger.dump_entry_stream(nvs_parser.iter_entries(sys.stdin.buffer))
+        else:
+            with open(args.file[0], 'rb') as f:
+                nvs_logger.dump_entry_stream(nvs_parser.iter_entries(f))
+        return 0
+
+    paths = expand_paths(args.file)
+    if paths != args.file or len(paths) > 1:
+        return check_batch(args, paths)
+
     try:
-        with open(args.file, 'rb') as f:
-            partition = f.read()
+        partitions = nvs_check.open_partitions(
+            paths[0], args.flash_image, args.partition, args.table_offset, args.cache_dir, args.workers
+        )
     except IndexError:
         nvs_log.error('No file given')
         raise
@@ -79,8 +343,6 @@ def main() -> None:
         nvs_log.error('Bad filename')
         raise
 
-    nvs = nvs_parser.NVS_Partition(args.file.split('/')[-1], bytearray(partition))
-
     def noop(_: nvs_parser.NVS_Partition) -> None:
         pass
 
@@ -90,24 +352,79 @@ def main() -> None:
     def cmd_not_implemented(_: nvs_parser.NVS_Partition) -> None:
         raise RuntimeError(f'{args.dump} is not implemented')
 
-    formats = {
-        'text': noop,
-        'json': nvs_logger.print_json,
-    }
-    formats.get(args.format, format_not_implemented)(nvs)
-
-    if args.format == 'text':
-        cmds = {
-            'all': nvs_logger.dump_everything,
-            'written': nvs_logger.dump_written_entries,
-            'minimal': nvs_logger.dump_key_value_pairs,
-            'namespaces': nvs_logger.list_namespaces,
-            'blobs': nvs_logger.dump_written_blobs,
-            'storage_info': nvs_logger.storage_stats,
-            'none': noop,
+    # Partitions of a flash image are printed as a single JSON array
+    json_array = args.flash_image and args.format == 'json'
+    json_end = '' if json_array else '\n'
+    if json_array:
+        sys.stdout.write('[')
+
+    findings = []
+    for partition_no, nvs in enumerate(partitions):
+        if args.flash_image and args.format == 'text' and nvs.source is not None:
+            nvs_log.info(nvs_log.cyan(f'NVS partition {nvs.name} (offset 0x{nvs.source[1]:x}, size 0x{nvs.source[2]:x})'))
+        if json_array and partition_no:
+            sys.stdout.write(', ')
+
+        formats = {
+            'text': noop,
+            'json': (
+                lambda nvs: nvs_logger.print_json(nvs, compact=args.json_compact, end=json_end)
+                if args.dump != 'gc' else nvs_logger.print_gc_json(nvs, args.write_size, args.write_type, end=json_end)
+            ),
+            'ndjson': lambda nvs: nvs_logger.print_ndjson(nvs, args.fields),
         }
-        cmds.get(args.dump, cmd_not_implemented)(nvs)  # type: ignore
+        formats.get(args.format, format_not_implemented)(nvs)
+
+        if args.format == 'text':
+            cmds = {
+                'all': nvs_logger.dump_everything,
+                'written': nvs_logger.dump_written_entries,
+                'minimal': nvs_logger.dump_key_value_pairs,
+                'namespaces': nvs_logger.list_namespaces,
+                'blobs': nvs_logger.dump_written_blobs,
+                'storage_info': nvs_logger.storage_stats,
+                'gc': lambda nvs: nvs_logger.gc_stats(nvs, args.write_size, args.write_type),
+                'none': noop,
+            }
+            cmds.get(args.dump, cmd_not_implemented)(nvs)  # type: ignore
 
         if args.integrity_check:
-            nvs_log.info()
-            nvs_check.integrity_check(nvs, nvs_log)
+            if args.findings == 'text' and args.format == 'text':
+                nvs_log.info()
+                check_log = nvs_log
+            else:
+                check_log = None  # Only findings are printed
+            partition_findings = nvs_check.integrity_check(nvs, check_log, args.checks, args.fail_fast)
+            findings.extend(partition_findings)
+            if args.findings == 'ndjson':
+                for finding in partition_findings:
+                    print(json.dumps(finding._asdict()), file=args.findings_file)
+            if args.fail_fast and any(finding.severity == 'error' for finding in partition_findings):
+                break
+
+    if json_array:
+        print(']')
+
+    if args.integrity_check and args.findings == 'json':
+        print(json.dumps({
+            'findings': [finding._asdict() for finding in findings],
+            'errors': sum(finding.severity == 'error' for finding in findings),
+            'warnings': sum(finding.severity == 'warning' for finding in findings),
+        }, indent=2), file=args.findings_file)
+
+    return 2 if any(finding.severity == 'error' for finding in findings) else 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except BrokenPipeError:
+        # Reader of the output went away (e.g. `| head`), silence the flush of stdout at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
+    except ValueError:
+        traceback.print_exc(file=sys.stderr)
+        sys.exit(1)
+    except nvs_parser.NVS_Constants.ConstantError:
+        traceback.print_exc(file=sys.stderr)
+        sys.exit(1)